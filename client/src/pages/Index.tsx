@@ -37,7 +37,8 @@ const Index = () => {
       const rawData: APIResponse = await response.json();
 
       // **1. Process the complex API response into a clean array of objects**
-      const processedResults: Publication[] = rawData.map((item) => {
+      // A stream that fails midway ends with an {"error": ...} element; keep the results before it
+      const processedResults: Publication[] = rawData.filter((item) => Array.isArray(item)).map((item) => {
         const abstractText = item[0]?.split('Abstract: ')[1] || "No abstract available.";
         const metadata = item[1];
         const categories = item[2];
@@ -1,15 +1,22 @@
 import os
-from flask import Flask, jsonify, request
+import hashlib
+from functools import lru_cache
+from itertools import chain
+from typing import Any, Iterable, Iterator
+from flask import Flask, request, stream_with_context
 from flask_cors import CORS
+from flask_caching import Cache
 from utils import *
 
 from pydantic import BaseModel, Field
+import orjson
 
 from dotenv import load_dotenv
 from groq import Groq
 import instructor
 
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 
 # Initialize the Flask application
 app = Flask(__name__)
@@ -19,15 +26,149 @@ load_dotenv()
 # This is crucial to allow your React frontend (running on a different port)
 # to communicate with this Flask backend.
 
+# Response cache: Redis when REDIS_URL is set (shared by all workers), else in-process
+REDIS_URL = os.getenv("REDIS_URL")
+cache = Cache(app, config={
+    "CACHE_TYPE": "RedisCache" if REDIS_URL else "SimpleCache",
+    "CACHE_REDIS_URL": REDIS_URL,
+    "CACHE_DEFAULT_TIMEOUT": 3600,
+})
+
 class GeneratedSummary(BaseModel):
     summary: str = Field(
         ...,
         description="Five sentences describing the entire information"
     )
 
+_PROMPT: str = """
+    Role and Goal: You are an expert academic research analyst. Your primary goal is to synthesize and summarize a research paper's core contribution based on its provided title, abstract, and publication date.
+
+    Structure & Content Requirements:
+
+    1.  Core Contribution : State the single most important finding or argument of the paper.
+    2.  Methodology/Approach : Briefly describe the primary method, model, or approach used to conduct the research.
+    3.  Key Findings : List the most significant results or conclusions.
+    4.  Significance and Context : Explain why this paper is important to its field and how the publication date might offer historical context.
+
+    Tone and Style: The summary must be objective, formal, and strictly academic. Do not use conversational language or qualifiers unless absolutely necessary. 
+
+    The summary should be 5 sentences in length.
+
+    Input Data:
+    """
+
+@lru_cache(maxsize=1)
+def _llm():
+    """Groq client wrapped by instructor, built once and reused (keeps its connection pool warm)."""
+    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+    return instructor.from_groq(client, mode=instructor.Mode.JSON)
+
+# $vectorSearch candidate pools: ANN recall vs. latency. Keep each well above its
+# result limit (25 for /search, 8 per collection for /kg_node).
+SEARCH_NUM_CANDIDATES = int(os.getenv("SEARCH_NUM_CANDIDATES", 100))
+NODE_NUM_CANDIDATES = int(os.getenv("NODE_NUM_CANDIDATES", 80))
+
 # create mongo client (reads MONGODB_URI from env; fallback to localhost)
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 print(f"Using MongoDB URI: {MONGODB_URI}")
+
+# One pooled client for the whole process; pymongo connects lazily and is thread-safe
+_mongo_client = MongoClient(MONGODB_URI, maxPoolSize=50)
+_mongo_db = _mongo_client[os.getenv("MONGO_DB_NAME", "gravitas")]
+_research_papers = _mongo_db["space_biology_research_papers"]
+_osdr = _mongo_db["osdr_experiments"]
+_classif = _mongo_db["space_research_classification"]
+
+def _collection_for(doc_id: str):
+    """Return the collection holding doc_id (PMC papers vs OSDR experiments)."""
+    if doc_id[:3] == "PMC":
+        return _research_papers
+    return _osdr
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+def _ojson(obj: Any, status: int = 200):
+    """jsonify replacement backed by orjson (C encoder, handles numpy/datetime natively)."""
+    return app.response_class(
+        orjson.dumps(obj, default=str, option=_ORJSON_OPTIONS),
+        status=status,
+        mimetype='application/json'
+    )
+
+# Last array element when the result stream fails after the 200 has been sent, so
+# the body still parses and the client can tell the results are incomplete
+_STREAM_ERROR = orjson.dumps({"error": "Results were cut short by a server error"})
+
+def _iter_json(items: Iterable[Any], prefix: str = "[", suffix: str = "]") -> Iterator[bytes]:
+    """Encode items as a JSON array chunk by chunk, so a Mongo cursor is never materialised."""
+    yield prefix.encode()
+    count = 0
+    try:
+        for item in items:
+            chunk = orjson.dumps(item, default=str, option=_ORJSON_OPTIONS)
+            yield b"," + chunk if count else chunk
+            count += 1
+    except Exception:
+        app.logger.exception("JSON stream failed after %d items", count)
+        if count:
+            yield b","
+        yield _STREAM_ERROR
+    yield suffix.encode()
+
+def _cache_chunks(key: str, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Pass chunks through and cache the full body once the stream completes without error."""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    if not any(part is _STREAM_ERROR for part in parts):
+        cache.set(key, b"".join(parts))
+
+def _stream_json(items: Iterable[Any], prefix: str = "[", suffix: str = "]", cache_key: str | None = None):
+    # Pull the first result before the response starts, so a query that fails
+    # outright still surfaces as a 500 instead of a 200 with a broken body
+    items = iter(items)
+    empty = object()
+    first = next(items, empty)
+    if first is not empty:
+        items = chain((first,), items)
+    chunks = _iter_json(items, prefix, suffix)
+    if cache_key:
+        chunks = _cache_chunks(cache_key, chunks)
+    return app.response_class(
+        stream_with_context(chunks),
+        mimetype='application/json'
+    )
+
+def _cached_json(cache_key: str):
+    """Return the cached JSON body for cache_key as a response, or None on a miss."""
+    body = cache.get(cache_key)
+    if body is None:
+        return None
+    return app.response_class(body, mimetype='application/json')
+
+def _format_search_hit(doc: dict) -> list:
+    # Format response to match frontend expectations: [document_string, metadata_object, categories_array]
+    metadata = {
+        "pmc_id": doc.get("_id", ""),
+        "title": doc.get("title", ""),
+        "authors": doc.get("authors", []),
+        "year": doc.get("year", ""),
+        "journal": doc.get("journal", ""),
+        "link": doc.get("link", ""),
+    }
+    return [doc.get("document", ""), metadata, doc.get("classification", {})]
+
+def _format_node(doc: dict) -> list:
+    # Format response to match frontend expectations: [document_string, metadata_object]
+    id_key = "pmc_id" if str(doc.get("_id", ""))[:3] == "PMC" else "osd_id"
+    metadata = {
+        id_key: doc.get("_id", ""),
+        "title": doc.get("title", ""),
+        "authors": doc.get("authors", []),
+    }
+    return [doc.get("document", ""), metadata]
+
 # --- API Endpoints ---
 
 @app.route('/search', methods=['POST'])
@@ -41,75 +182,79 @@ def search():
     query = data.get('query')
     
     if not query:
-        return jsonify({"error": "Query parameter is required"}), 400
+        return _ojson({"error": "Query parameter is required"}, 400)
+
+    cache_key = "search:" + hashlib.sha1(str(query).encode("utf-8")).hexdigest()
+    cached = _cached_json(cache_key)
+    if cached is not None:
+        return cached
     
     embeddings = generate_embeddings(query=query)
 
-    mongo_client = MongoClient(MONGODB_URI)
-    db_name = os.getenv("MONGO_DB_NAME", "gravitas")
-    mongo_db = mongo_client[db_name]
-
-    # Choose Mongo collection
-    research_papers = mongo_db.get_collection("space_biology_research_papers")
     pipeline = [
         {
             "$vectorSearch": {
                 "index": "embedding-search",      # name of your vector index
                 "path": "embedding",          # field where your vector is stored
                 "queryVector": embeddings,  # input vector
-                "numCandidates": 100,
+                "numCandidates": SEARCH_NUM_CANDIDATES,
                 "limit": 25
             }
         },
+        # Keep only what the result cards render (drops the stored embedding early)
         {
             "$project": {
                 "_id": 1,
                 "authors": 1,
                 "document": 1,
                 "link": 1,
-                "osdr_id": 1,
                 "title": 1,
                 "year": 1,
                 "journal": 1,
-                "score": { "$meta": "vectorSearchScore" }
+            }
+        },
+        # Join the topic classification server-side (matched on title)
+        {
+            "$lookup": {
+                "from": _classif.name,
+                "localField": "title",
+                "foreignField": "title",
+                "pipeline": [
+                    {"$project": {"_id": 0, "classification": 1}},
+                    {"$limit": 1}
+                ],
+                "as": "classification"
+            }
+        },
+        {
+            "$addFields": {
+                "classification": {
+                    "$ifNull": [{"$arrayElemAt": ["$classification.classification", 0]}, {}]
+                }
             }
         }
     ]
-    response = list(research_papers.aggregate(pipeline))
-
-    titles = [str(doc["title"]) for doc in response]
-
-    classification_coln = mongo_db.get_collection("space_research_classification")
-    classifications = list(classification_coln.find({
-        "title": {"$in": titles}
-    }))
-
-    classification_map = {str(item["title"]): item.get("classification", {}) for item in classifications}
-
-    data = []
-
-    for doc in response:
-        doc_id = str(doc["title"])
-        classification = classification_map.get(doc_id, {})
-        
-        # Format response to match frontend expectations: [document_string, metadata_object, categories_array]
-        metadata = {
-            "pmc_id": doc.get("_id", ""),
-            "title": doc.get("title", ""),
-            "authors": doc.get("authors", []),
-            "year": doc.get("year", ""),
-            "journal": doc.get("journal", ""),
-            "link": doc.get("link", ""),
-        }
-        
-        # Return as tuple format: [document_text, metadata, categories]
-        data.append([
-            doc.get("document", ""),
-            metadata,
-            classification
-        ])
 
-    return jsonify(data)
+    cursor = _research_papers.aggregate(pipeline)
+    return _stream_json((_format_search_hit(doc) for doc in cursor), cache_key=cache_key)
+
+
+# $vectorSearch inside a $unionWith sub-pipeline needs MongoDB 8.0+; older servers
+# reject the stage, after which /kg_node queries the two collections separately
+_union_vector_search = True
+
+def _node_neighbours(neighbours: list) -> Iterable[dict]:
+    """Run the neighbour pipeline over both collections, in one round trip when supported."""
+    global _union_vector_search
+    if _union_vector_search:
+        try:
+            return _research_papers.aggregate(neighbours + [
+                {"$unionWith": {"coll": "osdr_experiments", "pipeline": neighbours}}
+            ])
+        except OperationFailure as e:
+            print(f"$vectorSearch in $unionWith rejected ({e}); using one aggregate per collection")
+            _union_vector_search = False
+    return chain(_research_papers.aggregate(neighbours), _osdr.aggregate(neighbours))
 
 
 @app.route('/kg_node/<doc_id>', methods=['GET'])
@@ -120,83 +265,119 @@ def get_node_details(doc_id: str):
     """
 
     if not doc_id:
-        return jsonify({"error": "Context for summary is required"}), 400
-    
-
-    if doc_id[:3] == "PMC":
-        col = "space_biology_research_papers"
-    else:
-        col = "osdr_experiments"
-
-    mongo_client = MongoClient(MONGODB_URI)
-    db_name = os.getenv("MONGO_DB_NAME", "gravitas")
-    mongo_db = mongo_client[db_name]
+        return _ojson({"error": "Context for summary is required"}, 400)
 
-    # Choose Mongo collection
-    collection = mongo_db.get_collection(col)
+    cache_key = f"node:{doc_id}"
+    cached = _cached_json(cache_key)
+    if cached is not None:
+        return cached
 
-    response = collection.find_one({"_id": str(doc_id)})
-    query = str(response["document"]) #type: ignore
-    query_embedding = generate_embeddings(query=query)
+    response = _collection_for(doc_id).find_one(
+        {"_id": str(doc_id)},
+        {"document": 1, "embedding": 1}
+    )
+    if not response:
+        return _ojson({"error": "Document not found"}, 404)
 
-    collection_rp = mongo_client = MongoClient(MONGODB_URI)
-    db_name = os.getenv("MONGO_DB_NAME", "gravitas")
-    mongo_db = mongo_client[db_name]
+    # The node's own vector is already stored alongside it; only embed as a fallback
+    query_embedding = response.get("embedding")
+    if not query_embedding:
+        query_embedding = generate_embeddings(query=str(response["document"]))
 
-    pipeline = [
+    neighbours = [
         {
             "$vectorSearch": {
                 "index": "embedding-search",      # name of your vector index
                 "path": "embedding",          # field where your vector is stored
                 "queryVector": query_embedding,  # input vector
-                "numCandidates": 100,
-                "limit": 8
+                "numCandidates": NODE_NUM_CANDIDATES,
+                "limit": 8,
+                # The node itself is always its own nearest hit; drop it inside the ANN stage
+                # (requires _id as a filter field, see scripts/create_vector_index.py)
+                "filter": {"_id": {"$ne": str(doc_id)}}
             }
         },
         {
             "$project": {
+                # The graph only renders ids and titles; leave the paper body in Mongo
                 "_id": 1,
                 "authors": 1,
-                "document": 1,
                 "title": 1,
-                "score": { "$meta": "vectorSearchScore" }
             }
         }
     ]
+    cursor = _node_neighbours(neighbours)
+    return _stream_json((_format_node(doc) for doc in cursor), prefix='{"data": [', suffix=']}', cache_key=cache_key)
 
-    # Choose Mongo collection
-    research_papers = mongo_db.get_collection("space_biology_research_papers")
-    response_rp = list(research_papers.aggregate(pipeline))
 
-    osdr_exp = mongo_db.get_collection("osdr_experiments")
-    response_oe = list(osdr_exp.aggregate(pipeline))
+SUMMARY_MODEL = 'llama-3.1-8b-instant'  # currently working - llama-3.3-70b-versatile, llama3-8b-8192
+SUMMARY_CACHE_TIMEOUT = 24 * 3600
 
-    # Format response to match frontend expectations: [document_string, metadata_object]
-    data = []
-    
-    for doc in response_rp:
-        metadata = {
-            "pmc_id": doc.get("_id", ""),
-            "title": doc.get("title", ""),
-            "authors": doc.get("authors", []),
-        }
-        data.append([
-            doc.get("document", ""),
-            metadata
-        ])
-    
-    for doc in response_oe:
-        metadata = {
-            "osd_id": doc.get("_id", ""),
-            "title": doc.get("title", ""),
-            "authors": doc.get("authors", []),
+def _summary_key(doc_id: str, query: str) -> str:
+    return "summary:" + hashlib.sha1(f"{doc_id}\x00{query}".encode("utf-8")).hexdigest()
+
+def _load_document(doc_id: str) -> str:
+    """Fetch the text to summarise; raises LookupError for unknown ids."""
+    response = _collection_for(doc_id).find_one({"_id": doc_id}, {"document": 1})
+    if not response:
+        raise LookupError(doc_id)
+    return str(response["document"])
+
+def _summary_messages(document: str, query: str) -> list:
+    return [
+        {
+            "role": "user",
+            "content": f"{_PROMPT}{document}\n\nQuery: {query}"
         }
-        data.append([
-            doc.get("document", ""),
-            metadata
-        ])
+    ]
+
+def _summary_for(doc_id: str, query: str) -> str:
+    """
+    Generate (and cache) the LLM summary for a document. The prompt is
+    deterministic at low temperature, so repeats skip the Groq round trip.
+    Raises LookupError for unknown ids so misses are never cached.
+    """
+    key = _summary_key(doc_id, query)
+    summary = cache.get(key)
+    if summary is not None:
+        return summary
+
+    result = _llm().chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=_summary_messages(_load_document(doc_id), query),
+        temperature=0.2,
+        max_retries=3,
+        response_model=GeneratedSummary
+    ) # type:ignore
 
-    return jsonify({"data": data})
+    summary = result.model_dump()['summary']
+    if summary:
+        cache.set(key, summary, timeout=SUMMARY_CACHE_TIMEOUT)
+    return summary
+
+def _sse(payload: Any, event: str | None = None) -> bytes:
+    head = f"event: {event}\n".encode() if event else b""
+    return head + b"data: " + orjson.dumps(payload) + b"\n\n"
+
+def _stream_summary(doc_id: str, query: str, document: str) -> Iterator[bytes]:
+    """Server-sent events carrying the summary as it is generated (full text so far)."""
+    summary = ""
+    partials = _llm().chat.completions.create_partial(
+        model=SUMMARY_MODEL,
+        messages=_summary_messages(document, query),
+        temperature=0.2,
+        response_model=GeneratedSummary
+    ) # type:ignore
+    for partial in partials:
+        if partial.summary and partial.summary != summary:
+            summary = partial.summary
+            yield _sse({"summary": summary})
+
+    # Only reached once the stream finished normally (a client disconnect closes the
+    # generator at a yield, an LLM error raises); never cache an empty summary
+    if summary:
+        cache.set(_summary_key(doc_id, query), summary, timeout=SUMMARY_CACHE_TIMEOUT)
+    yield _sse({"summary": summary}, event="done")
 
 
 @app.route('/summary', methods=['POST'])
@@ -204,6 +385,8 @@ def get_summary():
     """
     Endpoint to generate a summary based on a selected node or user path.
     This would be the place to call a language model (LLM).
+    Send "stream": true (or Accept: text/event-stream) to receive the
+    summary incrementally as server-sent events.
     """
 
     data = request.get_json()
@@ -211,67 +394,36 @@ def get_summary():
     query = data.get("query")
 
     if not doc_id or not query:
-        return jsonify({"error": "Context for summary is required"}), 400
-    
-    if doc_id[:3] == "PMC":
-        col = "space_biology_research_papers"
-    else:
-        col = "osdr_experiments"
-
-    mongo_client = MongoClient(MONGODB_URI)
-    db_name = os.getenv("MONGO_DB_NAME", "gravitas")
-    mongo_db = mongo_client[db_name]
-
-    collection = mongo_db.get_collection(col)
-    response = collection.find_one({"_id": str(doc_id)})
-    
-    if not response:
-        return jsonify({"error": "Document not found"}), 404
-    
-    api_key = os.getenv("GROQ_API_KEY")
-    client = Groq(api_key=api_key)
-    client = instructor.from_groq(client, mode=instructor.Mode.JSON)
-
-    prompt: str = """
-    Role and Goal: You are an expert academic research analyst. Your primary goal is to synthesize and summarize a research paper's core contribution based on its provided title, abstract, and publication date.
-
-    Structure & Content Requirements:
-
-    1.  Core Contribution : State the single most important finding or argument of the paper.
-    2.  Methodology/Approach : Briefly describe the primary method, model, or approach used to conduct the research.
-    3.  Key Findings : List the most significant results or conclusions.
-    4.  Significance and Context : Explain why this paper is important to its field and how the publication date might offer historical context.
-
-    Tone and Style: The summary must be objective, formal, and strictly academic. Do not use conversational language or qualifiers unless absolutely necessary. 
-
-    The summary should be 5 sentences in length.
-
-    Input Data:
-    """
-
-    result = client.chat.completions.create(
-        model='llama-3.1-8b-instant',  # currently working - llama-3.3-70b-versatile, llama3-8b-8192
-        messages=[
-            {
-                "role": "user",
-                "content": prompt + str(response["document"]) + "\n\n Query: query" # type:ignore
-            }
-        ],
-        temperature=0.2,
-        max_retries=3,
-        response_model=GeneratedSummary
-    ) # type:ignore
-
-    summary = result.model_dump()['summary']
-
-    return jsonify({"summary": summary})
+        return _ojson({"error": "Context for summary is required"}, 400)
+
+    query = str(query)
+    wants_stream = bool(data.get("stream")) or request.accept_mimetypes.best == "text/event-stream"
+
+    if wants_stream:
+        cached = cache.get(_summary_key(doc_id, query))
+        if cached is not None:
+            events: Iterator[bytes] = iter([_sse({"summary": cached}, event="done")])
+        else:
+            try:
+                document = _load_document(doc_id)
+            except LookupError:
+                return _ojson({"error": "Document not found"}, 404)
+            events = _stream_summary(doc_id, query, document)
+        return app.response_class(stream_with_context(events), mimetype='text/event-stream')
+
+    try:
+        summary = _summary_for(doc_id, query)
+    except LookupError:
+        return _ojson({"error": "Document not found"}, 404)
+
+    return _ojson({"summary": summary})
 
 @app.route('/status', methods=['GET'])
 def status():
     """
     A simple status check endpoint to confirm the API is running.
     """
-    return jsonify({"status": "API is running"})
+    return _ojson({"status": "API is running"})
 
 
 if __name__ == '__main__':
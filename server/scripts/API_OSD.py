@@ -1,8 +1,15 @@
 import requests
 import csv
+import logging
 from datetime import datetime
-import time
-import json
+import orjson
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # --- Config ---
 BASE_URL = "https://visualization.osdr.nasa.gov/biodata/api"
@@ -10,43 +17,55 @@ START_ID = 1
 END_ID = 883
 OUTPUT_FILE = "dataset_summary_all_OSD.csv"
 CSV_HEADERS = ["accession_number", "study_title", "study_authors_combined", "study_description", "study_public_release_date_unix","study_public_release_date_readable"]
+MAX_WORKERS = 16 # concurrent requests; keeps us polite without a fixed sleep
+WRITE_BATCH = 64 # rows buffered before each writerows/flush
+WRITE_BUFFER = 1024 * 1024 # bytes buffered by the output file before hitting disk
+PROGRESS_EVERY = 50 # datasets between progress lines
+CACHE_DIR = os.path.join("server", "cache", "osd") # raw dataset JSON per accession, reused across runs
+REFRESH = "--refresh" in sys.argv # bypass the cache and re-download everything
 # ---------------------
 
+logger = logging.getLogger(__name__)
+
+# Runs of spaces in the joined OSDR descriptions: each pair keeps one space, a lone space is dropped
+_WS_RE = re.compile(r' ( ?)')
+
+# Keep-alive connection pool shared by all workers; urllib3 retries transient failures with backoff
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+))
+
+
 def custom_reverse_whitespace_cleanup(text: str) -> str:
     """
-    Applies the custom whitespace cleanup logic: iterates in reverse, removing 
-    all single whitespaces but preserving one in a double-whitespace sequence.
+    Applies the custom whitespace cleanup logic: removes all single whitespaces
+    but preserves one in a double-whitespace sequence, i.e. a run of n spaces
+    becomes n // 2 spaces.
     """
     if not text:
         return text
 
-    # Reverse the string and convert it to a list of characters
-    chars = list(text[::-1])
-    cleaned_chars_reverse = []
-    prev_was_whitespace = False
-    first_whitespace_removed = False
-
-    for char in chars:
-        if char == ' ':
-            if prev_was_whitespace:
-                # This is the second of two repeating whitespaces. Keep one.
-                cleaned_chars_reverse.append(char)
-                prev_was_whitespace = False
-            else:
-                # This is the first whitespace or a single one. Remove it.
-                if not first_whitespace_removed:
-                    first_whitespace_removed = True
-                else:
-                    pass  # Don't append the char
-                
-                prev_was_whitespace = True
-        else:
-            # Regular character, keep it.
-            cleaned_chars_reverse.append(char)
-            prev_was_whitespace = False
+    return _WS_RE.sub(r'\1', text)
+
+
+def load_cached_dataset(accession_number: str) -> bytes | None:
+    path = os.path.join(CACHE_DIR, f"{accession_number}.json")
+    if REFRESH or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
 
-    # Join the reversed list and reverse it back to the original order
-    return "".join(cleaned_chars_reverse)[::-1]
+def store_cached_dataset(accession_number: str, raw: bytes) -> None:
+    # Write to a temp file first so an interrupted run never leaves a truncated entry
+    path = os.path.join(CACHE_DIR, f"{accession_number}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(raw)
+    os.replace(tmp_path, path)
 
 
 def get_and_clean_metadata(accession_number: str) -> dict | None:
@@ -58,12 +77,19 @@ def get_and_clean_metadata(accession_number: str) -> dict | None:
     url = f"{BASE_URL}/v2/dataset/{accession_number}/"
     
     try:
-        response = requests.get(url, timeout=25)
-        response.raise_for_status() 
-        dataset_data = response.json()
+        raw = load_cached_dataset(accession_number)
+        if raw is None:
+            response = SESSION.get(url, timeout=25)
+            response.raise_for_status()
+            raw = response.content
+            dataset_data = orjson.loads(raw)
+            # Only cache payloads that parsed
+            store_cached_dataset(accession_number, raw)
+        else:
+            dataset_data = orjson.loads(raw)
         
-        # Access the main metadata object
-        metadata = dataset_data.get(accession_number, {}).get('metadata', {})
+        # Access the main metadata object; a missing block raises KeyError and skips the dataset
+        metadata = dataset_data[accession_number]['metadata']
         
         if not metadata:
             raise ValueError(f"Metadata block is empty for {accession_number}.")
@@ -71,7 +97,10 @@ def get_and_clean_metadata(accession_number: str) -> dict | None:
         # --- Extraction and Cleaning ---
         title = metadata.get('study title', 'N/A')
         # Authors
-        study_person = metadata.get('study person', {})
+        try:
+            study_person = metadata['study person']
+        except KeyError:
+            study_person = {}
         first_names = study_person.get('first name', '')
         last_names = study_person.get('last name', '')
         authors_combined = f"{first_names} {last_names}".strip().replace("  ", " ")
@@ -92,10 +121,7 @@ def get_and_clean_metadata(accession_number: str) -> dict | None:
                 release_readable = datetime.fromtimestamp(release_unix).strftime('%Y-%m-%d %H:%M:%S')
         if release_readable == 'N/A':
             release_unix = 'N/A'
-            
-        print(f"Processed {accession_number}")
-        
-        
+
         return {
             "accession_number": accession_number,
             "study_title": title,
@@ -105,37 +131,48 @@ def get_and_clean_metadata(accession_number: str) -> dict | None:
             "study_public_release_date_readable": release_readable
         }
 
-    except (requests.exceptions.RequestException, ValueError, json.JSONDecodeError, KeyError) as e:
+    except (requests.exceptions.RequestException, OSError, ValueError, orjson.JSONDecodeError, KeyError) as e:
+        logger.warning("Skipping %s: %s", accession_number, e)
         return None
 
+logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+
 skipped_count = 0
 successful_count = 0
 
-# Check if the output file exists to determine if we should write headers
-try:
-    with open(OUTPUT_FILE, 'r') as f:
-        write_headers = False
-except FileNotFoundError:
-    # File does not exist, write headers
-    write_headers = True
+os.makedirs(CACHE_DIR, exist_ok=True)
 
-with open(OUTPUT_FILE, 'a', newline='', encoding='utf-8') as csvfile:
+with open(OUTPUT_FILE, 'a', newline='', encoding='utf-8', buffering=WRITE_BUFFER) as csvfile:
     csv_writer = csv.DictWriter(csvfile, fieldnames=CSV_HEADERS)
-    if write_headers:
+    # An empty (or just created) file needs headers
+    csvfile.seek(0, os.SEEK_END)
+    if csvfile.tell() == 0:
         csv_writer.writeheader()
 
     print(f"Extraction from OSD-{START_ID} to OSD-{END_ID}...")
 
-    for i in range(START_ID, END_ID + 1):
-        accession = f"OSD-{i}"
-        data_row = get_and_clean_metadata(accession)
-        
-        if data_row:
-            csv_writer.writerow(data_row)
-            successful_count += 1
-        else:
-            skipped_count += 1
-        time.sleep(0.1) #sleep so that you dont get black listed for DoS lol
+    accessions = [f"OSD-{i}" for i in range(START_ID, END_ID + 1)]
+    rows_buf = []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # map() yields in submission order, so the CSV stays sorted by accession
+        for data_row in executor.map(get_and_clean_metadata, accessions):
+            if data_row:
+                rows_buf.append(data_row)
+                successful_count += 1
+            else:
+                skipped_count += 1
+
+            done = successful_count + skipped_count
+            if done % PROGRESS_EVERY == 0:
+                print(f"Processed {done}/{len(accessions)}")
+
+            if len(rows_buf) >= WRITE_BATCH:
+                csv_writer.writerows(rows_buf)
+                csvfile.flush()
+                rows_buf.clear()
+
+    if rows_buf:
+        csv_writer.writerows(rows_buf)
 
 print("\n" + "=" * 50)
 print(f"Total datasets in range: {END_ID - START_ID + 1}")
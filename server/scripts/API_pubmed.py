@@ -1,167 +1,383 @@
 import requests
-import xml.etree.ElementTree as ET
 import csv
+import gzip
+import logging
+import os
 import re
-import time
-from typing import List, Dict, Any, Optional
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from itertools import islice
+from typing import List, Dict, Any, Optional, Tuple
+
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from rate_limit import RateLimiter
 
 # --- Config ---
 NCBI_API_URL = r"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
 OUTPUT_CSV_FILENAME = r"server\static\extracted_article_data.csv"
 INPUT_CSV_FILENAME = r"server\static\publications.csv"
 TARGET_SECTIONS = ["Abstract", "Introduction", "Methods", "Results", "Discussion", "Outcomes", "Conclusion"]
+NCBI_API_KEY = os.environ.get("NCBI_API_KEY") # optional; raises NCBI's limit from 3 to 10 requests/s
+NCBI_TOOL = "gravitas" # identifies us to NCBI, as their E-utilities policy asks
+NCBI_EMAIL = os.environ.get("NCBI_EMAIL") # contact address NCBI can use before blocking a tool
+REQUESTS_PER_SECOND = 10 if NCBI_API_KEY else 3
+MAX_WORKERS = REQUESTS_PER_SECOND # enough in-flight batches to use the whole budget
+BATCH_SIZE = 100 # PMC IDs per efetch call
+FETCH_AHEAD = MAX_WORKERS * 2 # downloaded batches allowed to wait for parsing
+PARSE_WORKERS = os.cpu_count() or 1 # processes parsing article XML
+WRITE_BUFFER = 1024 * 1024 # bytes buffered by the output file before hitting disk
+CACHE_DIR = os.path.join("server", "cache", "pmc") # gzipped <article> XML per PMC ID, reused across runs
+REFRESH = "--refresh" in sys.argv # bypass the cache and re-download everything
+SEC_ID_MAP = {"s4": "Outcomes", "s5": "Conclusion"} # sections some journals only mark by @id
+TITLE_KEYWORDS = [(section, section.lower()) for section in TARGET_SECTIONS]
 # ---------------
 
+# Keep-alive connection pool shared by all workers; urllib3 retries transient failures with backoff
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=20,
+    # efetch is read-only, so the POSTed batches are safe to retry too
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["GET", "POST"])
+))
+
+# Shared by all fetch threads; requests are evenly spaced (no burst) so no one second
+# ever exceeds NCBI's limit. Only real efetch calls wait, cache hits are free
+NCBI_LIMITER = RateLimiter(REQUESTS_PER_SECOND * 60)
+
+# Elements parse_article needs; everything else is skipped by the C-level iterator
+_WALK_TAGS = ("article-title", "journal-title", "article-id", "year", "contrib", "abstract", "sec")
+_SURNAME_XP = etree.XPath("string((.//surname)[1])")
+_GIVEN_NAMES_XP = etree.XPath("string((.//given-names)[1])")
+
+logger = logging.getLogger(__name__)
+
+_PMCID_RE = re.compile(r'(PMC\d+)', re.IGNORECASE)
+_WS_RE = re.compile(r'\s+')
+
 def get_pmcid_from_url(url):
-    match = re.search(r'(PMC\d+)', url, re.IGNORECASE)
+    match = _PMCID_RE.search(url)
     return match.group(1) if match else None
 
-def extract_text(element: Optional[ET.Element]) -> str:
+def extract_text(element: Optional[etree._Element]) -> str:
     """
     Extracts all  content from an XML element
     """
     if element is None:
         return ""
-    text_parts = [text.strip() for text in element.itertext() if text and text.strip()]
-    return " ".join(text_parts)
-
-def extract_article_section(root: ET.Element, title_pattern):
-    
-    lower_pattern = title_pattern.lower()
-
-    if lower_pattern == "abstract":
-        return extract_text(root.find(".//abstract"))
-    
-    # General Outcomes
-    if lower_pattern == "outcomes" or lower_pattern == "general outcomes":
-        outcomes_elem = root.find(".//sec[@id='s4']")
-        return extract_text(outcomes_elem)
-
-    # Conclusion
-    if lower_pattern == "conclusion":
-        conclusion_elem = root.find(".//sec[@id='s5']")
-        if conclusion_elem is not None:
-            return extract_text(conclusion_elem)
-        
-    # Partial title match
-    for title_elem in root.findall('.//sec/title'):
-        if title_elem.text and lower_pattern in title_elem.text.lower():
-            return extract_text(title_elem)
-
-    # Sec-type attribute
-    sec_elem = root.find(f".//sec[@sec-type='{lower_pattern}']")
-    if sec_elem is not None:
-        return extract_text(sec_elem)
-
-    return ""
-
-def fetch_and_parse_article(pmcid):
-    """
-    Fetches XML for a given PMC ID and parses it into a dictionary of data.
-    """
-    params = {
-        "db": "pmc",
-        "id": pmcid,
-        "retmode": "xml"
+    return _WS_RE.sub(" ", " ".join(element.itertext())).strip()
+
+def classify_sec(sec: etree._Element, by_id: Dict[str, etree._Element],
+                 by_title: Dict[str, etree._Element], by_type: Dict[str, etree._Element]) -> None:
+    """
+    Records the first <sec> matching each TARGET_SECTIONS entry by @id (SEC_ID_MAP), partial title and @sec-type
+    """
+    section = SEC_ID_MAP.get(sec.get("id"))
+    if section is not None:
+        by_id.setdefault(section, sec)
+
+    title = sec.find("title")
+    if title is not None and title.text:
+        lower_title = title.text.lower()
+        for section, keyword in TITLE_KEYWORDS:
+            if section not in by_title and keyword in lower_title:
+                by_title[section] = sec
+
+    sec_type = sec.get("sec-type")
+    if sec_type:
+        by_type.setdefault(sec_type, sec)
+
+def resolve_sections(abstract: Optional[etree._Element], by_id: Dict[str, etree._Element],
+                     by_title: Dict[str, etree._Element], by_type: Dict[str, etree._Element]) -> Dict[str, str]:
+    """
+    Picks each TARGET_SECTIONS entry by @id, then partial title match, then @sec-type
+    """
+    sections = {"Abstract": extract_text(abstract)}
+    for section, keyword in TITLE_KEYWORDS:
+        if section in sections:
+            continue
+        sec = by_id.get(section)
+        if sec is None:
+            sec = by_title.get(section)
+        if sec is None:
+            sec = by_type.get(keyword)
+        sections[section] = extract_text(sec)
+    return sections
+
+def get_article_pmcid(article: etree._Element) -> Optional[str]:
+    """
+    Reads the PMC ID of an <article> from a <pmc-articleset>, normalised to "PMC<digits>"
+    """
+    for id_type in ("pmcid", "pmc"):
+        value = article.findtext(f"./front/article-meta/article-id[@pub-id-type='{id_type}']")
+        if value and value.strip():
+            value = value.strip().upper()
+            return value if value.startswith("PMC") else f"PMC{value}"
+    return None
+
+def format_author(contrib: etree._Element) -> str:
+    surname = _SURNAME_XP(contrib)
+    given_names = _GIVEN_NAMES_XP(contrib).strip()
+    initial = given_names[0] if given_names else ''
+    return f"{surname}, {initial}"
+
+def parse_article(article: etree._Element, pmcid: str) -> Dict[str, Any]:
+    """
+    Parses a single <article> subtree into a dictionary of data in one walk over its elements.
+    """
+    firsts: Dict[str, etree._Element] = {}
+    doi = None
+    pub_year = None
+    authors = []
+    by_id: Dict[str, etree._Element] = {}
+    by_title: Dict[str, etree._Element] = {}
+    by_type: Dict[str, etree._Element] = {}
+
+    for elem in article.iter(*_WALK_TAGS):
+        tag = elem.tag
+        if tag == "sec":
+            classify_sec(elem, by_id, by_title, by_type)
+        elif tag == "contrib":
+            if elem.get("contrib-type") == "author" and elem.getparent().tag == "contrib-group":
+                authors.append(format_author(elem))
+        elif tag == "article-id":
+            if doi is None and elem.get("pub-id-type") == "doi":
+                doi = elem.text or ""
+        elif tag == "year":
+            if pub_year is None and elem.getparent().tag == "pub-date":
+                pub_year = elem.text or ""
+        else:
+            # article-title, journal-title, abstract: the first one wins
+            firsts.setdefault(tag, elem)
+
+    return {
+        "PMC_ID": pmcid,
+        "DOI": doi,
+        "Title": extract_text(firsts.get("article-title")),
+        "Journal": extract_text(firsts.get("journal-title")),
+        "Year": pub_year,
+        "Authors": "; ".join(authors),
+        **resolve_sections(firsts.get("abstract"), by_id, by_title, by_type)
     }
-    max_retries = 3
-    retry_delay = 1  # seconds
 
-    for attempt in range(max_retries):
+def load_cached_article(pmcid: str) -> Optional[bytes]:
+    path = os.path.join(CACHE_DIR, f"{pmcid}.xml.gz")
+    if REFRESH or not os.path.exists(path):
+        return None
+    with gzip.open(path, "rb") as f:
+        return f.read()
+
+def store_cached_article(pmcid: str, xml_bytes: bytes) -> None:
+    # Write to a temp file first so an interrupted run never leaves a truncated entry
+    path = os.path.join(CACHE_DIR, f"{pmcid}.xml.gz")
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wb") as f:
+        f.write(xml_bytes)
+    os.replace(tmp_path, path)
+
+def fetch_article_batch(pmcids: List[str]) -> Dict[str, bytes]:
+    """
+    Fetches XML for a batch of PMC IDs in one efetch call and splits the
+    returned <pmc-articleset> into one serialized <article> per upper-cased
+    PMC ID. Articles already in CACHE_DIR are read from disk and left out of
+    the request; IDs missing from the response are simply absent.
+    Transient HTTP failures are retried by the session's urllib3 Retry policy.
+    """
+    wanted = list(dict.fromkeys(pmcid.upper() for pmcid in pmcids))
+    articles: Dict[str, bytes] = {}
+    to_fetch = []
+    for pmcid in wanted:
         try:
-            r = requests.get(NCBI_API_URL, params=params, timeout=30)
+            cached = load_cached_article(pmcid)
+        except Exception as e:
+            logger.warning("[%s] Ignoring unreadable cache entry: %s", pmcid, e)
+            cached = None
+        if cached is None:
+            to_fetch.append(pmcid)
+        else:
+            articles[pmcid] = cached
+
+    if to_fetch:
+        params = {
+            "db": "pmc",
+            "id": ",".join(to_fetch),
+            "retmode": "xml"
+        }
+        params["tool"] = NCBI_TOOL
+        if NCBI_EMAIL:
+            params["email"] = NCBI_EMAIL
+        if NCBI_API_KEY:
+            params["api_key"] = NCBI_API_KEY
+
+        try:
+            NCBI_LIMITER.wait()
+            # POST keeps long comma-joined ID lists out of the URL
+            r = SESSION.post(NCBI_API_URL, data=params, timeout=120)
             r.raise_for_status()
-            xml_content = r.text
-            root = ET.fromstring(xml_content)
-            
-            # Core Metadata
-            article_title = extract_text(root.find(".//article-title"))
-            journal_title = extract_text(root.find(".//journal-title"))
-            doi = root.findtext(".//article-id[@pub-id-type='doi']")
-            pub_year = root.findtext(".//pub-date/year")
-
-            # Authors
-            authors = []
-            for contrib in root.findall(".//contrib-group/contrib[@contrib-type='author']"):
-                surname = contrib.findtext(".//surname")
-                given_names = contrib.findtext(".//given-names")
-                initial = given_names.split()[0][0] if given_names else ''
-                authors.append(f"{surname}, {initial}")
-            author_list = "; ".join(authors)
-
-            # Article Sections
-            data_sections = {}
-            for section in TARGET_SECTIONS:
-                data_sections[section] = extract_article_section(root, section)
-            
-            article_data = {
-                "PMC_ID": pmcid,
-                "DOI": doi,
-                "Title": article_title,
-                "Journal": journal_title,
-                "Year": pub_year,
-                "Authors": author_list,
-                **data_sections
-            }
-            return article_data
-            
+
+            # Stream the <article> elements of the <pmc-articleset> and free each one once serialized
+            for _, article in etree.iterparse(BytesIO(r.content), tag="article", huge_tree=True, recover=True):
+                pmcid = get_article_pmcid(article)
+                if pmcid is not None:
+                    xml_bytes = etree.tostring(article, encoding="utf-8")
+                    articles[pmcid] = xml_bytes
+                    try:
+                        store_cached_article(pmcid, xml_bytes)
+                    except OSError as e:
+                        logger.warning("[%s] Could not cache article: %s", pmcid, e)
+                article.clear()
+                while article.getprevious() is not None:
+                    del article.getparent()[0]
+
+        except Exception as e:
+            logger.warning("[%s..%s] Error occurred: %s", to_fetch[0], to_fetch[-1], e)
+
+    return articles
+
+def parse_one(item: Tuple[str, Optional[bytes]]) -> Dict[str, Any]:
+    """
+    Parses one serialized <article> into a row. Runs in a worker process,
+    so it must stay a module-level function.
+    """
+    pmcid, xml_bytes = item
+    if xml_bytes is not None:
+        try:
+            article = etree.fromstring(xml_bytes, etree.XMLParser(huge_tree=True, recover=True))
+            return parse_article(article, pmcid)
         except Exception as e:
-            print(f"[{pmcid}] : Error occurred: {e}")
-        
-        if attempt < max_retries - 1:
-            time.sleep(retry_delay * (2 ** attempt)) # Really dont want to get blacklisted
-        
-    print(f"[{pmcid}] Failed to process")
+            logger.warning("[%s] Error occurred: %s", pmcid, e)
+
+    logger.warning("[%s] Failed to process", pmcid)
     return {"PMC_ID": pmcid, "Error": "Failed to fetch or parse data"}
 
+def fetch_batch(batch: List[Dict[str, Any]]) -> List[Tuple[str, Optional[bytes]]]:
+    fetched = fetch_article_batch([article['PMC_ID'] for article in batch])
+    return [(article['PMC_ID'].upper(), fetched.get(article['PMC_ID'].upper())) for article in batch]
+
+def read_articles_to_fetch() -> List[Dict[str, Any]]:
+    """
+    Reads the input CSV, keeping the first row for each PMC ID
+    """
+    articles_to_fetch = []
+    seen = set()
+    try:
+        with open(INPUT_CSV_FILENAME, mode='r', newline='', encoding='utf-8') as infile:
+            reader = csv.DictReader(infile)
+            for row in reader:
+                pmcid = get_pmcid_from_url(row['Link'])
+                if pmcid and pmcid.upper() in seen:
+                    continue
+                if pmcid:
+                    seen.add(pmcid.upper())
+                    articles_to_fetch.append({
+                        "Title_Input": row['Title'],
+                        "Link_Input": row['Link'],
+                        "PMC_ID": pmcid
+                    })
+                else:
+                    logger.warning("Could not find PMC ID in link: %s", row['Link'])
+
+    except FileNotFoundError:
+        print(f"Input file not found")
+    except Exception as e:
+        print(f"Error reading input CSV")
 
-articles_to_fetch = []
-try:
-    with open(INPUT_CSV_FILENAME, mode='r', newline='', encoding='utf-8') as infile:
+    return articles_to_fetch
+
+def compact_output() -> set:
+    """
+    Rewrites the output CSV keeping one error-free row per PMC ID and returns those IDs.
+    A resumed run then re-fetches the failed IDs without their old Error rows staying behind
+    """
+    done = set()
+    if not os.path.exists(OUTPUT_CSV_FILENAME):
+        return done
+    # Section columns can be far larger than csv's default 128 KiB field limit
+    csv.field_size_limit(2**31 - 1)
+    dropped = 0
+    tmp_path = OUTPUT_CSV_FILENAME + ".tmp"
+    with open(OUTPUT_CSV_FILENAME, mode='r', newline='', encoding='utf-8') as infile, \
+            open(tmp_path, mode='w', newline='', encoding='utf-8', buffering=WRITE_BUFFER) as outfile:
         reader = csv.DictReader(infile)
+        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames or [], extrasaction='ignore')
+        writer.writeheader()
         for row in reader:
-            pmcid = get_pmcid_from_url(row['Link'])
-            if pmcid:
-                articles_to_fetch.append({
-                    "Title_Input": row['Title'],
-                    "Link_Input": row['Link'],
-                    "PMC_ID": pmcid
-                })
+            pmcid = (row.get('PMC_ID') or '').upper()
+            if pmcid and not row.get('Error') and pmcid not in done:
+                done.add(pmcid)
+                writer.writerow(row)
             else:
-                print(f"Warning: Could not find PMC ID in link: {row['Link']}")
-
-except FileNotFoundError:
-    print(f"Input file not found")
-except Exception as e:
-    print(f"Error reading input CSV")
-
-print(f"Found {len(articles_to_fetch)} PMC IDs")
-output_fieldnames = [
-    "PMC_ID", "DOI", "Title", "Journal", "Year", "Authors", 
-    *TARGET_SECTIONS, 
-    "Title_Input", "Link_Input", "Error"
-]
-
-processed_data: List[Dict[str, Any]] = []
-
-for i, article in enumerate(articles_to_fetch):
-    pmcid = article['PMC_ID']
-    print(f"--- Processing {i + 1}/{len(articles_to_fetch)}: {pmcid} ---")
-    data = fetch_and_parse_article(pmcid)
-    data['Title_Input'] = article['Title_Input']
-    data['Link_Input'] = article['Link_Input']
-    
-    processed_data.append(data)
-    
-    time.sleep(0.5) # Lets not get blacklisted
-
-try:
-    with open(OUTPUT_CSV_FILENAME, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=output_fieldnames, extrasaction='ignore')
-        writer.writeheader()
-        writer.writerows(processed_data)
+                dropped += 1
+    if dropped:
+        os.replace(tmp_path, OUTPUT_CSV_FILENAME)
+        print(f"Dropped {dropped} failed or duplicate rows from the output; failed IDs are fetched again")
+    else:
+        os.remove(tmp_path)
+    return done
+
+def main():
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    articles_to_fetch = read_articles_to_fetch()
+    print(f"Found {len(articles_to_fetch)} PMC IDs")
+    if not REFRESH:
+        done = compact_output()
+        articles_to_fetch = [a for a in articles_to_fetch if a['PMC_ID'].upper() not in done]
+        print(f"Skipping {len(done)} already in the output, {len(articles_to_fetch)} left")
+    output_fieldnames = [
+        "PMC_ID", "DOI", "Title", "Journal", "Year", "Authors", 
+        *TARGET_SECTIONS, 
+        "Title_Input", "Link_Input", "Error"
+    ]
+
+    batches = [articles_to_fetch[i:i + BATCH_SIZE] for i in range(0, len(articles_to_fetch), BATCH_SIZE)]
+    processed = 0
+
+    try:
+        # Append to resume a previous run; --refresh rebuilds the file from scratch
+        mode = 'w' if REFRESH else 'a'
+        with open(OUTPUT_CSV_FILENAME, mode, newline='', encoding='utf-8', buffering=WRITE_BUFFER) as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=output_fieldnames, extrasaction='ignore')
+            csvfile.seek(0, os.SEEK_END)
+            if csvfile.tell() == 0:
+                writer.writeheader()
+
+            # Threads download up to FETCH_AHEAD batches ahead while worker processes parse
+            # the CPU-bound XML, so raw XML held in memory stays bounded. Batches are consumed
+            # in submission order, so the output CSV keeps the input ordering; rows go
+            # straight to the file instead of being held for the whole run
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as fetcher, \
+                    ProcessPoolExecutor(max_workers=PARSE_WORKERS) as parser:
+                batch_iter = iter(batches)
+                pending = deque((batch, fetcher.submit(fetch_batch, batch)) for batch in islice(batch_iter, FETCH_AHEAD))
+                while pending:
+                    batch, future = pending.popleft()
+                    next_batch = next(batch_iter, None)
+                    if next_batch is not None:
+                        pending.append((next_batch, fetcher.submit(fetch_batch, next_batch)))
+                    items = future.result()
+                    rows = list(parser.map(parse_one, items, chunksize=16))
+                    for article, data in zip(batch, rows):
+                        data['Title_Input'] = article['Title_Input']
+                        data['Link_Input'] = article['Link_Input']
+                    writer.writerows(rows)
+                    # One flush per efetch batch keeps a valid partial CSV on disk if the run dies
+                    csvfile.flush()
+                    processed += len(batch)
+                    print(f"--- Processed {processed}/{len(articles_to_fetch)}: up to {batch[-1]['PMC_ID']} ---")
+
+        print(f"Data successfully saved")
+
+    except Exception as e:
+        print(f"Error occurred: {e}")
 
-    print(f"Data successfully saved")
 
-except Exception as e:
-    print(f"Error occurred: {e}")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,20 @@
 import os
-from time import sleep
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from time import monotonic
 from groq import Groq
 import instructor
 
 from pydantic import BaseModel, Field
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Tuple
 from dotenv import load_dotenv
 
-import json
+import orjson
 import csv
 import sqlite3
 
+from rate_limit import RateLimiter
+
 topics = [
     "Musculoskeletal System and Biomechanics",
     "Cardiovascular and Vascular Health",
@@ -31,6 +35,12 @@ client = Groq(api_key=api_key)
 
 client = instructor.from_groq(client, mode=instructor.Mode.JSON)
 
+MAX_WORKERS = 8 # concurrent Groq requests
+MAX_IN_FLIGHT = MAX_WORKERS * 2 # submitted rows not yet finished
+REQUESTS_PER_MINUTE = 30 # Groq rate limit for llama-3.1-8b-instant on our plan
+
+limiter = RateLimiter(REQUESTS_PER_MINUTE)
+
 # Define the structured output schema
 class PaperClassification(BaseModel):
     selected_categories: List[str] = Field(
@@ -75,10 +85,18 @@ ABSTRACT: {abstract}
 
 # Database file
 DB_FILE = "server/static/papers.db"
+COMMIT_EVERY = 50 # classifications per executemany/transaction
+FLUSH_INTERVAL = 2.0 # seconds before a partial batch is written anyway
 
 # Initialize connection
-def init_db():
+def init_db() -> sqlite3.Connection:
+    """
+    Opens the one connection used for the whole run. WAL with synchronous=NORMAL
+    means a commit no longer waits on an fsync of the main database file.
+    """
     conn = sqlite3.connect(DB_FILE)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
     cur = conn.cursor()
     # Create table if it doesn’t exist
     cur.execute("""
@@ -89,27 +107,29 @@ def init_db():
     )
     """)
     conn.commit()
-    conn.close()
     print("✅ Database initialized and table ensured.")
+    return conn
 
-# Insert classification data
-def store_classification(title: str, classification: Dict[str, Any]):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-
-    # Convert classification dict to JSON string
-    classification_json = json.dumps(classification, ensure_ascii=False)
+# Insert a batch of classification data in one transaction
+def store_classifications(conn: sqlite3.Connection, rows: List[Tuple[str, Any]]):
+    # Convert each classification to a JSON string
+    params = [(title, orjson.dumps(classification).decode()) for title, classification in rows]
 
     # Insert or replace (so you can reclassify a paper without duplicates)
-    cur.execute("""
-    INSERT INTO classifications (title, classification)
-    VALUES (?, ?)
-    ON CONFLICT(title) DO UPDATE SET classification = excluded.classification
-    """, (title, classification_json))
+    with conn:
+        conn.executemany("""
+        INSERT INTO classifications (title, classification)
+        VALUES (?, ?)
+        ON CONFLICT(title) DO UPDATE SET classification = excluded.classification
+        """, params)
 
-    conn.commit()
-    conn.close()
-    print(f"✅ Stored classification for: {title}")
+    print(f"✅ Stored {len(rows)} classifications")
+
+def classify_row(row: Tuple[str, str]) -> Tuple[str, List[str]]:
+    title, abstract = row
+    limiter.wait()
+    classification = classify_paper(title, abstract)
+    return title, classification.model_dump()["selected_categories"]
 
 def read_columns(csv_file, col3_index=2, col7_index=6):
     """
@@ -135,16 +155,35 @@ def read_columns(csv_file, col3_index=2, col7_index=6):
 # Example usage
 if __name__ == "__main__":
     data = read_columns("server/static/data_pubmed.csv")
-    init_db()
-
-    for idx, (title, abstract) in enumerate(data[406:]):
-        print(idx+406)
-        try:
-            classification = classify_paper(title, abstract)
-            classification_result = classification.model_dump()["selected_categories"]
-            store_classification(title, classification_result)
-        except Exception as e:
-            print(e)
-
-        if (idx+178) % 25 == 0:
-            sleep(40)
\ No newline at end of file
+    conn = init_db()
+
+    pending: List[Tuple[str, Any]] = []
+    idx = 0
+    try:
+        # Workers only call Groq (paced by the shared limiter) and never touch the database;
+        # this thread is the single writer, flushing every COMMIT_EVERY results or FLUSH_INTERVAL seconds
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            # Only a bounded window is queued, topped up as calls finish, so an interrupt
+            # waits for at most MAX_IN_FLIGHT calls rather than the whole remaining file
+            rows = iter(data[406:])
+            in_flight = {executor.submit(classify_row, row) for row in islice(rows, MAX_IN_FLIGHT)}
+            last_flush = monotonic()
+            while in_flight:
+                done, in_flight = wait(in_flight, timeout=FLUSH_INTERVAL, return_when=FIRST_COMPLETED)
+                in_flight.update(executor.submit(classify_row, row) for row in islice(rows, len(done)))
+                for future in done:
+                    print(idx+406)
+                    idx += 1
+                    try:
+                        pending.append(future.result())
+                    except Exception as e:
+                        print(e)
+
+                if len(pending) >= COMMIT_EVERY or (pending and monotonic() - last_flush >= FLUSH_INTERVAL):
+                    store_classifications(conn, pending)
+                    pending.clear()
+                    last_flush = monotonic()
+    finally:
+        if pending:
+            store_classifications(conn, pending)
+        conn.close()
\ No newline at end of file
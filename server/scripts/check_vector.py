@@ -1,38 +1,56 @@
+from functools import lru_cache
+from typing import Any, Dict, List
+
 import chromadb
+import numpy as np
+
+CHROMA_PATH = r"server\static\chroma"
 
 # --- 1. Connection Setup ---
-# Initialize the ChromaDB client. 
+# Initialize the ChromaDB client once and reuse it for every lookup.
 # Use the appropriate client for your setup (Persistent, HTTP, or in-memory).
 # Example for a persistent local database:
-client = chromadb.PersistentClient(path="server\static\chroma") 
+@lru_cache(maxsize=1)
+def get_client() -> Any:
+    return chromadb.PersistentClient(path=CHROMA_PATH)
 
 # --- 2. Get the Collection ---
-# Replace 'your_collection_name' with the name of your target collection.
-collection = client.get_collection(name="research_papers")
+# Replace 'research_papers' with the name of your target collection.
+@lru_cache(maxsize=None)
+def get_collection(name: str = "research_papers") -> Any:
+    return get_client().get_collection(name=name)
 
-# --- 3. Define the Target ID ---
-# Replace 'the_specific_vector_id' with the unique ID of the vector you want to retrieve.
-# This ID should match the ID assigned during the vector creation/upload process.
-target_id = "chunk_PMC4136787" 
+# --- 3. Define the Target IDs ---
+# Replace with the unique IDs of the vectors you want to retrieve.
+# These IDs should match the IDs assigned during the vector creation/upload process.
+target_ids = ["chunk_PMC4136787"]
 
 # --- 4. Retrieve the Specific Vector Data ---
 # Use .get() and include the 'embeddings' field.
-# By setting 'ids', you retrieve only the specified vector.
-result = collection.get(
-    ids=[target_id],
-    include=['embeddings', 'documents', 'metadatas'] 
-)
-
-# --- 5. Extract and Display the Vector ---
-if result['ids']:
-    print(f"✅ Successfully retrieved vector for ID: {result['ids'][0]}")
-    
-    # The actual vector is the first (and only) item in the 'embeddings' list
-    specific_vector = result['embeddings'][0]
-    
-    print("-" * 30)
-    print(f"Vector Dimension (Length): {len(specific_vector)}")
-    print(f"First 20 components: {specific_vector[:20]}")
-
-else:
-    print(f"❌ Error: Vector with ID '{target_id}' not found.")
\ No newline at end of file
+# All ids are fetched in a single call, however many there are.
+def get_vectors(ids: List[str]) -> Dict[str, Any]:
+    return get_collection().get(
+        ids=ids,
+        include=['embeddings', 'documents', 'metadatas']
+    )
+
+
+if __name__ == '__main__':
+    result = get_vectors(target_ids)
+
+    # --- 5. Extract and Display the Vectors ---
+    found = set(result['ids'])
+    for vector_id, embedding in zip(result['ids'], result['embeddings']):
+        print(f"✅ Successfully retrieved vector for ID: {vector_id}")
+
+        # One float32 array, so norms / similarities below run in numpy instead of over Python floats
+        specific_vector = np.asarray(embedding, dtype=np.float32)
+
+        print("-" * 30)
+        print(f"Vector Shape: {specific_vector.shape}")
+        print(f"First 20 components: {specific_vector[:20]}")
+        print(f"L2 Norm: {np.linalg.norm(specific_vector):.6f}")
+
+    for target_id in target_ids:
+        if target_id not in found:
+            print(f"❌ Error: Vector with ID '{target_id}' not found.")
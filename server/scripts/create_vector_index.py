@@ -0,0 +1,79 @@
+"""Create / update the Atlas vector search indexes used by the Flask app
+
+`app.py` runs `$vectorSearch` against the index named `embedding-search`
+on both `space_biology_research_papers` and `osdr_experiments`. This
+script (re)defines that index on each collection:
+
+  - `embedding` as the vector field (cosine similarity), with Atlas
+    automatic scalar (int8) quantization so the ANN graph is ~4x smaller
+  - `_id` as a filter field, so `/kg_node` can pre-filter the queried
+    node out of its own neighbour search inside the ANN stage
+
+Run this script directly (no CLI args) after exporting to Mongo.
+Configure via `MONGODB_URI`, `MONGO_DB_NAME`, `GEMINI_EMBEDDING_DIM` and
+`VECTOR_QUANTIZATION` (none | scalar | binary, default scalar).
+"""
+
+from typing import Any, Dict
+
+import os
+
+from pymongo import MongoClient
+from pymongo.operations import SearchIndexModel
+import dotenv
+
+dotenv.load_dotenv()
+
+MONGO_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
+MONGO_DB = os.environ.get('MONGO_DB_NAME', 'gravitas')
+COLLECTIONS = ['space_biology_research_papers', 'osdr_experiments']
+INDEX_NAME = 'embedding-search'
+EMBEDDING_DIMENSION = int(os.getenv('GEMINI_EMBEDDING_DIM', 1024))
+QUANTIZATION = os.environ.get('VECTOR_QUANTIZATION', 'scalar')
+
+
+def index_definition(num_dimensions: int, quantization: str) -> Dict[str, Any]:
+    return {
+        'fields': [
+            {
+                'type': 'vector',
+                'path': 'embedding',
+                'numDimensions': num_dimensions,
+                'similarity': 'cosine',
+                # Atlas quantizes the stored float vectors itself and rescores
+                # with full fidelity, so documents keep their float embeddings
+                'quantization': quantization,
+            },
+            {
+                'type': 'filter',
+                'path': '_id',
+            },
+        ]
+    }
+
+
+def ensure_vector_index(coll: Any, definition: Dict[str, Any]) -> None:
+    existing = {idx['name'] for idx in coll.list_search_indexes()}
+    if INDEX_NAME in existing:
+        coll.update_search_index(INDEX_NAME, definition)
+        print(f"Updated '{INDEX_NAME}' on {coll.full_name}")
+    else:
+        model = SearchIndexModel(definition=definition, name=INDEX_NAME, type='vectorSearch')
+        coll.create_search_index(model)
+        print(f"Created '{INDEX_NAME}' on {coll.full_name}")
+
+
+def main():
+    client = MongoClient(MONGO_URI)
+    db = client[MONGO_DB]
+    definition = index_definition(EMBEDDING_DIMENSION, QUANTIZATION)
+
+    for name in COLLECTIONS:
+        ensure_vector_index(db[name], definition)
+
+    client.close()
+    print("Done. Atlas builds the indexes asynchronously; check their status in the UI.")
+
+
+if __name__ == '__main__':
+    main()
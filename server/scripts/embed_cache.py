@@ -0,0 +1,113 @@
+"""Content-addressed embedding cache shared by the vectorizer scripts
+
+Vectors are stored as packed float16 in a small SQLite file keyed by
+blake2b(model || stripped text), so re-running a vectorizer (or embedding
+the same title/abstract for both PubMed and OSDR) only sends the texts
+the cache has not seen to the embedding backend. Vectors are cached as
+returned by the backend; `l2_normalize` is applied by the callers.
+
+Pass `--no-cache` on the command line to bypass the cache entirely.
+"""
+
+from hashlib import blake2b
+from typing import Callable, List, Optional, Sequence
+
+import os
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join("server", "cache", "embeddings.sqlite3"))
+NO_CACHE = "--no-cache" in sys.argv
+
+
+def l2_normalize(vectors: Sequence[Sequence[float]]) -> List[List[float]]:
+    """Scale each vector to unit length so cosine reduces to a dot product (Chroma "ip" space)."""
+    if not len(vectors):
+        return []
+    arr = np.asarray(vectors, dtype=np.float32)
+    arr /= np.linalg.norm(arr, axis=1, keepdims=True) + 1e-12
+    return arr.tolist()
+
+
+def cache_key(model: str, text: str) -> bytes:
+    return blake2b(f"{model}\0{text.strip()}".encode("utf-8"), digest_size=20).digest()
+
+
+class EmbedCache:
+    """Persistent text -> vector cache.
+
+    Vectors are stored as packed float16: half the size of float32 for a
+    cosine error well under 0.1%, which is below what ranking can notice.
+    """
+
+    def __init__(self, path: str = EMBED_CACHE_PATH, enabled: bool = not NO_CACHE):
+        self.enabled = enabled
+        self.conn: Optional[sqlite3.Connection] = None
+        # The vectorizers embed on worker threads; one lock serializes access to the
+        # shared connection, while the embedding calls themselves run unlocked
+        self.lock = threading.Lock()
+        if not enabled:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings_f16 (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def get_many(self, keys: Sequence[bytes]) -> dict:
+        found = {}
+        with self.lock:
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i : i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings_f16 WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float16).astype(np.float32).tolist()
+        return found
+
+    def put_many(self, items: List[tuple]) -> None:
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings_f16 (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float16).tobytes()) for key, vector in items]
+            )
+
+    def get_or_compute_many(
+        self,
+        texts: Sequence[str],
+        model: str,
+        embed_batch: Callable[[List[str]], List[Sequence[float]]]
+    ) -> List[Sequence[float]]:
+        """Returns one vector per text, calling embed_batch only for cache misses."""
+        if not self.enabled:
+            return embed_batch(list(texts))
+
+        keys = [cache_key(model, text) for text in texts]
+        found = self.get_many(list(set(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        missing_keys = list(missing)
+        missing_texts = list(missing.values())
+
+        if missing_texts:
+            vectors = embed_batch(missing_texts)
+            # A failed call (e.g. quota) returns no vectors; don't cache a partial result
+            if len(vectors) != len(missing_texts):
+                return []
+            self.put_many(list(zip(missing_keys, vectors)))
+            found.update(zip(missing_keys, vectors))
+
+        return [found[key] for key in keys]
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
@@ -13,10 +13,13 @@ Run this script directly (no CLI args). Configure Mongo connection via
 from typing import List, Dict, Any
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import chromadb
 from chromadb.config import Settings
+from bson.binary import Binary, BinaryVectorDtype
 from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 import dotenv
 
 dotenv.load_dotenv()
@@ -26,8 +29,10 @@ CHROMA_COLLECTION = "osdr_experiments"
 MONGO_URI = os.getenv('MONGODB_URI')
 MONGO_DB = os.environ.get('MONGO_DB_NAME', 'Gravitas-DB')
 MONGO_COLLECTION = os.environ.get('MONGO_COLLECTION_NAME', 'osdr_experiments')
+BULK_WRITE_BATCH = 1000
+GET_WORKERS = 8 # concurrent collection.get batches
 
-def iter_collection(client: Any, collection_name: str, batch_size: int = 256) -> List[Dict[str, Any]]:
+def iter_collection(client: Any, collection_name: str, batch_size: int = 2048) -> List[Dict[str, Any]]:
     collection = client.get_collection(name=collection_name)
     try:
         ids = collection.get()['ids']
@@ -37,17 +42,21 @@ def iter_collection(client: Any, collection_name: str, batch_size: int = 256) ->
         except Exception as e:
             raise RuntimeError("Unable to list ids from Chroma collection: %s" % e)
 
+    def get_batch(batch_ids: List[str]) -> Dict[str, Any]:
+        return collection.get(ids=batch_ids, include=['embeddings', 'documents', 'metadatas'])
+
+    batches = [ids[i : i + batch_size] for i in range(0, len(ids), batch_size)]
     items: List[Dict[str, Any]] = []
-    for i in range(0, len(ids), batch_size):
-        batch_ids = ids[i : i + batch_size]
-        result = collection.get(ids=batch_ids, include=['embeddings', 'documents', 'metadatas'])
-        for idx, _id in enumerate(result.get('ids', [])):
-            items.append({
-                'id': _id,
-                'embedding': result.get('embeddings', [None])[idx] ,
-                'document': result.get('documents', [None])[idx] ,
-                'metadata': result.get('metadatas', [None])[idx],
-            })
+    # Chroma's SQLite reads release the GIL, so batches overlap; map() keeps id order
+    with ThreadPoolExecutor(max_workers=GET_WORKERS) as executor:
+        for result in executor.map(get_batch, batches):
+            for idx, _id in enumerate(result.get('ids', [])):
+                items.append({
+                    'id': _id,
+                    'embedding': result.get('embeddings', [None])[idx] ,
+                    'document': result.get('documents', [None])[idx] ,
+                    'metadata': result.get('metadatas', [None])[idx],
+                })
 
     return items
 
@@ -57,14 +66,40 @@ try:
 except Exception:
     _np = None
 
+# Values BSON encodes as-is; checked by exact type so subclasses still take the slow path
+_PLAIN_TYPES = frozenset({str, int, float, bool, type(None), bytes})
+_NP_SCALAR_TYPES = (_np.floating, _np.integer, _np.bool_) if _np is not None else ()
+
 
 def _sanitize_for_bson(obj: Any) -> Any:
     """Recursively convert objects not serializable by BSON (e.g. numpy arrays/scalars)
-    into Python built-ins (lists, ints, floats, dicts).
+    into Python built-ins (lists, ints, floats, dicts). Plain values, and dicts/lists
+    holding only plain values, are returned untouched without recursing.
     """
-    # handle numpy arrays and objects exposing tolist()
-    if _np is not None and isinstance(obj, _np.ndarray):
-        return _sanitize_for_bson(obj.tolist())
+    t = type(obj)
+    if t in _PLAIN_TYPES:
+        return obj
+
+    # dict -> sanitize keys and values
+    if t is dict:
+        if all(type(k) is str and type(v) in _PLAIN_TYPES for k, v in obj.items()):
+            return obj
+        # ensure key is a string for Mongo
+        return {(k if isinstance(k, str) else str(k)): _sanitize_for_bson(v) for k, v in obj.items()}
+
+    if t is list and all(type(v) in _PLAIN_TYPES for v in obj):
+        return obj
+
+    # handle numpy arrays; tolist() already yields Python scalars
+    if _np is not None and t is _np.ndarray:
+        return obj.tolist() if obj.dtype != object else _sanitize_for_bson(obj.tolist())
+
+    # numpy scalar types (e.g., np.float32)
+    if isinstance(obj, _NP_SCALAR_TYPES):
+        try:
+            return obj.item()
+        except Exception:
+            pass
 
     # objects exposing tolist (but not strings/bytes)
     if not isinstance(obj, (str, bytes, bytearray)) and hasattr(obj, 'tolist'):
@@ -73,22 +108,9 @@ def _sanitize_for_bson(obj: Any) -> Any:
         except Exception:
             pass
 
-    # numpy scalar types (e.g., np.float32)
-    if _np is not None:
-        if isinstance(obj, (_np.floating, _np.integer, _np.bool_)):
-            try:
-                return obj.item()
-            except Exception:
-                pass
-
-    # dict -> sanitize keys and values
+    # dict subclasses -> sanitize keys and values
     if isinstance(obj, dict):
-        new = {}
-        for k, v in obj.items():
-            # ensure key is a string for Mongo
-            key = k if isinstance(k, str) else str(k)
-            new[key] = _sanitize_for_bson(v)
-        return new
+        return {(k if isinstance(k, str) else str(k)): _sanitize_for_bson(v) for k, v in obj.items()}
 
     # lists/tuples/sets -> list
     if isinstance(obj, (list, tuple, set)):
@@ -98,6 +120,34 @@ def _sanitize_for_bson(obj: Any) -> Any:
     return obj
 
 
+def _to_vector(embedding: Any) -> Any:
+    """Pack an embedding as a BSON float32 vector (BinData subtype 9): 4 bytes per
+    dimension instead of a tagged double per element. Atlas Vector Search indexes
+    this type directly, so `$vectorSearch` and `/kg_node` keep working.
+    """
+    if embedding is None:
+        return None
+    if _np is not None:
+        embedding = _np.asarray(embedding, dtype=_np.float32)
+    else:
+        embedding = [float(v) for v in embedding]
+    return Binary.from_vector(embedding, BinaryVectorDtype.FLOAT32)
+
+
+def _bulk_upsert(coll: Any, ops: List[UpdateOne]) -> int:
+    """Unordered bulk write so the server can apply the independent upserts in
+    parallel; documents that fail are reported and skipped instead of aborting
+    the rest of the batch.
+    """
+    try:
+        result = coll.bulk_write(ops, ordered=False)
+        return result.upserted_count + result.modified_count
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        print(f"bulk_write: {len(errors)} of {len(ops)} ops failed (first: {errors[0].get('errmsg') if errors else 'n/a'})")
+        return e.details.get('nUpserted', 0) + e.details.get('nModified', 0)
+
+
 def upsert_to_mongo(mongo_uri: str, db_name: str, collection_name: str, items: List[Dict[str, Any]]) -> int:
     client = MongoClient(mongo_uri)
     db = client[db_name]
@@ -116,7 +166,9 @@ def upsert_to_mongo(mongo_uri: str, db_name: str, collection_name: str, items: L
         title = metadata.get('title')
         authors = metadata.get('authors')
         link = metadata.get('link')
-        embedding = item.get('embeddings')
+        raw_embedding = item.get('embedding')
+        embedding_dim = len(raw_embedding) if raw_embedding is not None else None
+        embedding = _to_vector(raw_embedding)
 
         # The original vectorizer stored a combined text as document. Keep it if present.
         document = item.get('document')
@@ -128,7 +180,8 @@ def upsert_to_mongo(mongo_uri: str, db_name: str, collection_name: str, items: L
             'authors': authors,
             'link': link,
             'document': document,
-            'embedding': item.get('embedding'),
+            'embedding': embedding,
+            'embedding_dim': embedding_dim,
             'chroma_id': item.get('id'),
         }
         # Upsert by _id (osdr_id)
@@ -139,14 +192,12 @@ def upsert_to_mongo(mongo_uri: str, db_name: str, collection_name: str, items: L
         set_doc = _sanitize_for_bson(set_doc)
         ops.append(UpdateOne({'_id': osdr_id}, {'$set': set_doc}, upsert=True))
 
-        if len(ops) >= 500:
-            result = coll.bulk_write(ops)
-            count += result.upserted_count + result.modified_count
+        if len(ops) >= BULK_WRITE_BATCH:
+            count += _bulk_upsert(coll, ops)
             ops = []
 
     if ops:
-        result = coll.bulk_write(ops)
-        count += result.upserted_count + result.modified_count
+        count += _bulk_upsert(coll, ops)
 
     client.close()
     return count
@@ -160,7 +211,7 @@ def run_export():
         settings = Settings(chroma_db_impl="duckdb+parquet", persist_directory=CHROMA_PATH)
         client = chromadb.Client(settings=settings)
 
-    items = iter_collection(client, CHROMA_COLLECTION, batch_size=256)
+    items = iter_collection(client, CHROMA_COLLECTION, batch_size=2048)
     print(f"Exporting from Chroma '{CHROMA_COLLECTION}' at {CHROMA_PATH} to MongoDB {MONGO_URI} {MONGO_DB}.{MONGO_COLLECTION}")
 
     # print(items[0])
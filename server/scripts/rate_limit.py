@@ -0,0 +1,24 @@
+"""Thread-safe request pacing shared by the scripts that call rate-limited APIs
+(Groq in categorize.py, Gemini in the vectorizer scripts, NCBI in API_pubmed.py).
+"""
+
+import threading
+from time import monotonic, sleep
+
+
+class RateLimiter:
+    """
+    Spaces calls at least 60 / per_minute seconds apart across all threads
+    """
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / per_minute
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            sleep(at - now)
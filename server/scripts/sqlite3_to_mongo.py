@@ -14,12 +14,14 @@ This script is minimal and uses environment variables:
   - SQLITE_PATH (path to sqlite file, default server/static/chroma/chroma.sqlite3)
 """
 
-from typing import List, Dict, Any
+from typing import Iterable, Iterator, List, Dict, Any
 import os
-import json
 import sqlite3
 
+import orjson
+
 from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 import dotenv
 
 dotenv.load_dotenv()
@@ -28,6 +30,8 @@ SQLITE_PATH = os.environ.get('SQLITE_PATH', 'server/static/papers.db')
 MONGO_URI = os.environ.get('MONGODB_URI', 'mongodb://localhost:27017')
 MONGO_DB = os.environ.get('MONGO_DB_NAME', 'medosearch')
 MONGO_COLLECTION = os.environ.get('MONGO_COLLECTION_NAME', 'classifications')
+BULK_WRITE_BATCH = 1000
+FETCH_BATCH = 1000
 
 
 def parse_classification(value: Any) -> List[str]:
@@ -46,7 +50,7 @@ def parse_classification(value: Any) -> List[str]:
         s = value.strip()
         # try JSON first
         try:
-            parsed = json.loads(s)
+            parsed = orjson.loads(s)
             if isinstance(parsed, list):
                 return [str(x) for x in parsed]
         except Exception:
@@ -60,29 +64,50 @@ def parse_classification(value: Any) -> List[str]:
     return [str(value)]
 
 
-def read_sqlite_rows(sqlite_path: str) -> List[Dict[str, Any]]:
+def read_sqlite_rows(sqlite_path: str) -> Iterator[Dict[str, Any]]:
+    """Stream rows FETCH_BATCH at a time instead of loading the whole table."""
     if not os.path.exists(sqlite_path):
         raise FileNotFoundError(f"SQLite file not found: {sqlite_path}")
 
     conn = sqlite3.connect(sqlite_path)
     conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT id, title, classification FROM classifications")
-    rows = []
-    for r in cur.fetchall():
-        rows.append({
-            'id': r['id'],
-            'title': r['title'],
-            'classification': parse_classification(r['classification'])
-        })
-
-    conn.close()
-    return rows
-
-
-def upsert_rows(mongo_uri: str, db_name: str, collection_name: str, rows: List[Dict[str, Any]]) -> int:
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id, title, classification FROM classifications")
+        while True:
+            batch = cur.fetchmany(FETCH_BATCH)
+            if not batch:
+                break
+            for r in batch:
+                yield {
+                    'id': r['id'],
+                    'title': r['title'],
+                    'classification': parse_classification(r['classification'])
+                }
+    finally:
+        conn.close()
+
+
+def _bulk_upsert(coll: Any, ops: List[UpdateOne]) -> int:
+    """Unordered bulk write so the server can apply the independent upserts in
+    parallel; documents that fail are reported and skipped instead of aborting
+    the rest of the batch.
+    """
+    try:
+        result = coll.bulk_write(ops, ordered=False)
+        return result.upserted_count + result.modified_count
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        print(f"bulk_write: {len(errors)} of {len(ops)} ops failed (first: {errors[0].get('errmsg') if errors else 'n/a'})")
+        return e.details.get('nUpserted', 0) + e.details.get('nModified', 0)
+
+
+def upsert_rows(mongo_uri: str, db_name: str, collection_name: str, rows: Iterable[Dict[str, Any]]) -> int:
     client = MongoClient(mongo_uri)
     coll = client[db_name][collection_name]
+    # /search joins classifications onto its hits by title ($lookup); without this
+    # index every hit is a collection scan. A no-op when the index already exists
+    coll.create_index('title')
     ops = []
     count = 0
     for r in rows:
@@ -94,14 +119,12 @@ def upsert_rows(mongo_uri: str, db_name: str, collection_name: str, rows: List[D
             'classification': r.get('classification')
         }
         ops.append(UpdateOne({'_id': _id}, {'$set': doc}, upsert=True))
-        if len(ops) >= 500:
-            res = coll.bulk_write(ops)
-            count += res.upserted_count + res.modified_count
+        if len(ops) >= BULK_WRITE_BATCH:
+            count += _bulk_upsert(coll, ops)
             ops = []
 
     if ops:
-        res = coll.bulk_write(ops)
-        count += res.upserted_count + res.modified_count
+        count += _bulk_upsert(coll, ops)
 
     client.close()
     return count
@@ -109,9 +132,7 @@ def upsert_rows(mongo_uri: str, db_name: str, collection_name: str, rows: List[D
 
 def main():
     rows = read_sqlite_rows(SQLITE_PATH)
-    print(f"Read {len(rows)} rows from {SQLITE_PATH}")
-
-    print(rows[0])
+    print(f"Streaming rows from {SQLITE_PATH}")
 
     count = upsert_rows(MONGO_URI, MONGO_DB, MONGO_COLLECTION, rows)
     print(f"Upserted/modified approx {count} docs into {MONGO_DB}.{MONGO_COLLECTION}")
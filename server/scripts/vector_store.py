@@ -0,0 +1,54 @@
+"""Chroma collection setup shared by the vectorizer scripts
+
+Every collection records the embedding model, vector dimension and distance
+space it was built with in its metadata. Reopening it with a different
+configuration stops the run rather than skipping rows that were embedded by
+another backend or upserting vectors of the wrong size; pass `--rebuild` to
+drop the collection and re-embed everything.
+"""
+
+from typing import Any, Dict
+
+import sys
+
+# Keys compared when an existing collection is reopened
+EMBEDDING_KEYS = ("embedding_model", "embedding_dim", "embedding_space")
+
+
+def collection_metadata(hnsw: Dict[str, Any], model: str, dim: int) -> Dict[str, Any]:
+    """HNSW parameters plus the embedding configuration the collection is built with."""
+    return {
+        **hnsw,
+        "embedding_model": model,
+        "embedding_dim": dim,
+        "embedding_space": hnsw.get("hnsw:space", "l2"),
+    }
+
+
+def open_collection(client: Any, name: str, metadata: Dict[str, Any], rebuild: bool, **kwargs: Any) -> Any:
+    """
+    Returns the collection, dropping it first when `rebuild` is set. Exits if an
+    existing collection was built with a different model, dimension or space
+    (collections from before this metadata was recorded count as different).
+    """
+    if rebuild:
+        try:
+            client.delete_collection(name=name)
+            print(f"Successfully deleted old collection: '{name}'")
+        except Exception as e:
+            print(f"Collection '{name}' not deleted ({e}), proceeding to create.")
+
+    collection = client.get_or_create_collection(name=name, metadata=metadata, **kwargs)
+
+    stored = collection.metadata or {}
+    mismatched = [
+        f"{key}: stored {stored.get(key)!r}, expected {metadata[key]!r}"
+        for key in EMBEDDING_KEYS
+        if stored.get(key) != metadata[key]
+    ]
+    if mismatched:
+        sys.exit(
+            f"Collection '{name}' was built with a different embedding configuration "
+            f"({'; '.join(mismatched)}). Re-run with --rebuild to re-embed it."
+        )
+    return collection
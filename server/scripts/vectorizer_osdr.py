@@ -1,28 +1,107 @@
-import csv
-import json
-from typing import List
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, List, Set, Tuple
 import chromadb
+import pandas as pd
 from chromadb.utils import embedding_functions
 
+from embed_cache import EmbedCache, l2_normalize
+from vector_store import collection_metadata, open_collection
+
+# --- Logging ---
+# Records go through a queue and are written by the listener's thread, so the
+# ingest loop never blocks on stdout; per-row detail is DEBUG, batches are INFO.
+logger = logging.getLogger(__name__)
+log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue()
+listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+logging.basicConfig(level=logging.INFO, handlers=[logging.handlers.QueueHandler(log_queue)])
+listener.start()
+atexit.register(listener.stop)
+
 # --- Initialize ChromaDB ---
-client = chromadb.PersistentClient("server/static/chroma")
-collection = client.get_collection(
-    name="osdr_experiments"
+# Set CHROMA_HOST to write through a Chroma server (`chroma run --path server/static/chroma`)
+# instead of opening the store in-process, so several vectorizers can ingest at once
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", 8000))
+if CHROMA_HOST:
+    client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+else:
+    client = chromadb.PersistentClient("server/static/chroma")
+MODEL_NAME = "qwen3-embedding:4b"
+ollama_embedder = embedding_functions.OllamaEmbeddingFunction(model_name=MODEL_NAME)
+# Ollama doesn't report the model's output size, so one probe embedding records it
+EMBEDDING_DIMENSION = len(ollama_embedder(["dimension probe"])[0])
+embed_cache = EmbedCache()
+
+# Rows already in the collection are skipped unless --rebuild drops and recreates it
+REBUILD = "--rebuild" in sys.argv
+
+collection = open_collection(
+    client,
+    "osdr_experiments",
+    # HNSW index parameters (recall vs. latency); fixed when the collection is created.
+    # Embeddings are stored L2-normalized, so inner product ranks exactly like cosine
+    collection_metadata(
+        {"hnsw:space": "ip", "hnsw:M": 16, "hnsw:construction_ef": 200, "hnsw:search_ef": 50},
+        MODEL_NAME,
+        EMBEDDING_DIMENSION
+    ),
+    REBUILD
 )
 
-ollama_embedder = embedding_functions.OllamaEmbeddingFunction(model_name="qwen3-embedding:4b")
+BATCH_SIZE = 250 # rows per Ollama embed request and per collection.upsert transaction
+
+EMBED_WORKERS = 2 # batches embedded concurrently while the main thread writes to Chroma
+MAX_PENDING = 4 # embedded batches held in memory awaiting the Chroma write
+
+PendingBatch = Tuple[List[str], List[str], List[dict], Future]
+
+def embed_documents(documents: List[str]) -> List[List[float]]:
+    """Embeds the batch's cache misses in one Ollama call; runs on the worker pool."""
+    return l2_normalize(embed_cache.get_or_compute_many(documents, MODEL_NAME, ollama_embedder))
+
+def add_batch(pending: PendingBatch):
+    """Waits for a submitted batch's embeddings and upserts it with a single collection.upsert."""
+    ids, documents, metadatas, future = pending
+    collection.upsert(
+        ids=ids,
+        embeddings=future.result(),
+        documents=documents,
+        metadatas=metadatas
+    )
+    logger.info("Added batch of %d rows", len(ids))
+
+ids: List[str] = []
+documents: List[str] = []
+metadatas: List[dict] = []
+# IDs already batched; duplicates are dropped before they cost an embedding call
+seen_ids: Set[str] = set()
+# One ID-only read up front, so rerun rows never reach the embedder
+existing_ids = set() if REBUILD else set(collection.get(include=[])["ids"])
+if existing_ids:
+    logger.info("Skipping %d IDs already in the collection (pass --rebuild to re-embed)", len(existing_ids))
+# CSV parsing, embedding and Chroma writes overlap: full batches are embedded on the
+# pool while this thread keeps reading rows and writes finished batches in order
+pending: Deque[PendingBatch] = deque()
+executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS)
 
 with open("server/static/data_OSD.csv", newline='', encoding="utf-8") as csvfile:
-    reader = csv.reader(csvfile)
-    reader.__next__()
+    # C parser, all columns as plain strings; the header row is consumed here. Short rows
+    # come back padded with "", rows with extra fields are skipped with a warning
+    reader = pd.read_csv(csvfile, dtype=str, keep_default_na=False, on_bad_lines="warn").itertuples(index=False, name=None)
     
     for row in reader:
         osd_id = row[0]
         authors = row[2]
         link = f"https://osdr.nasa.gov/bio/repo/data/studies/{osd_id}"
 
-        print(f"OSD ID: {osd_id}")
-        print(f"Authors: {authors}")
+        logger.debug("OSD ID: %s | Authors: %s", osd_id, authors)
 
         # Data to embed
         title = row[1]
@@ -30,18 +109,36 @@ with open("server/static/data_OSD.csv", newline='', encoding="utf-8") as csvfile
 
 
         layer1_text = f"Title: {title}\nDescription: {description}"
-        embeddings = ollama_embedder([layer1_text])
-        
-
-        collection.add(
-            ids = [f"chunk_{osd_id}"],
-            embeddings=ollama_embedder([layer1_text]),
-            documents=[layer1_text],
-            metadatas=[{
-                "osd_id": osd_id,
-                "title": title,
-                "authors": authors,
-                "link": link
-            }]
-        )
+
+        if osd_id in seen_ids:
+            logger.debug("Skipping duplicate OSD ID: %s", osd_id)
+            continue
+        seen_ids.add(osd_id)
+        if f"chunk_{osd_id}" in existing_ids:
+            continue
+
+        ids.append(f"chunk_{osd_id}")
+        documents.append(layer1_text)
+        metadatas.append({
+            "osd_id": osd_id,
+            "title": title,
+            "authors": authors,
+            "link": link
+        })
+
+        if len(ids) >= BATCH_SIZE:
+            pending.append((ids, documents, metadatas, executor.submit(embed_documents, documents)))
+            ids, documents, metadatas = [], [], []
+
+            # Write the oldest batch once enough are in flight, bounding memory
+            if len(pending) >= MAX_PENDING:
+                add_batch(pending.popleft())
+
+    # Add any remaining rows
+    if ids:
+        pending.append((ids, documents, metadatas, executor.submit(embed_documents, documents)))
+    while pending:
+        add_batch(pending.popleft())
+
+executor.shutdown()
 
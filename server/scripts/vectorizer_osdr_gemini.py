@@ -1,13 +1,20 @@
-import csv
 import os
-import time
-from typing import List
+import sys
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Deque, Dict, List, Set, Tuple
 import chromadb
+import pandas as pd
 from google import genai
 from chromadb.api.types import Documents, Embeddings
 from chromadb.utils import embedding_functions
 from dotenv import load_dotenv
 
+from embed_cache import EmbedCache, l2_normalize
+from rate_limit import RateLimiter
+from vector_store import collection_metadata, open_collection
+
 load_dotenv()
 
 # --- Configuration ---
@@ -17,27 +24,59 @@ if not GEMINI_API_KEY:
 
 # ChromaDB Configuration
 CHROMA_PATH = "server/static/chroma"
+# Set CHROMA_HOST to write through a Chroma server (`chroma run --path server/static/chroma`)
+# instead of opening the store in-process, so several vectorizers can ingest at once
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", 8000))
 COLLECTION_NAME = "osdr_experiments"
+# Rows already in the collection are skipped unless --rebuild drops and recreates it
+REBUILD = "--rebuild" in sys.argv
 CSV_FILE_PATH = "server/static/data_OSD.csv"
 
 # Gemini Embedding Configuration
 MODEL_NAME = "models/gemini-embedding-001"
-EMBEDDING_DIMENSION = 2560 
+# Matryoshka-trained model: a 1024-D prefix keeps retrieval quality at 40% of the size.
+# Must match GEMINI_EMBEDDING_DIM used by the app for queries and by the Atlas index.
+EMBEDDING_DIMENSION = int(os.getenv("GEMINI_EMBEDDING_DIM", 1024))
+EMBED_WORKERS = 8  # Concurrent embed_content requests
+# Quota is enforced by spacing requests, not by sleeping after every batch
+REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_EMBED_RPM", 60))
+MAX_PENDING = EMBED_WORKERS * 2  # Embedded batches held in memory awaiting the Chroma write
+
+# HNSW index parameters (recall vs. latency); fixed when the collection is created
+HNSW_METADATA = {
+    # Embeddings are stored L2-normalized, so inner product ranks exactly like cosine
+    "hnsw:space": "ip",
+    "hnsw:M": 16,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 50,
+}
 
 # --- Custom Gemini Embedding Function for ChromaDB ---
 
+@lru_cache(maxsize=None)
+def get_genai_client(api_key: str) -> genai.Client:
+    # One client per key: every embedder instance and worker thread shares its pooled connections
+    return genai.Client(api_key=api_key)
+
 class GeminiEmbeddingFunction(embedding_functions.EmbeddingFunction):
     """A custom EmbeddingFunction to use the Google Gemini API."""
     def __init__(self, api_key: str, model_name: str, output_dim: int):
-        self.client = genai.Client(api_key=api_key)
+        self.client = get_genai_client(api_key)
         self.model = model_name
         self.output_dim = output_dim
+        self.cache = EmbedCache()
 
     def __call__(self, input: Documents) -> Embeddings:
+        """Serves cached vectors, only sends the cache misses to Gemini, and L2-normalizes the result."""
+        return l2_normalize(self.cache.get_or_compute_many(input, f"{self.model}:{self.output_dim}", self.embed_batch))
+
+    def embed_batch(self, input: List[str]) -> Embeddings:
         """Generates embeddings for a list of documents (batching)."""
         embeddings_list: List[List[float]] = []
         
         try:
+            limiter.wait()
             result = self.client.models.embed_content(
                 model=self.model,
                 contents=input, 
@@ -63,6 +102,50 @@ class GeminiEmbeddingFunction(embedding_functions.EmbeddingFunction):
             print(f" Error calling Gemini embedding API for batch of size {len(input)}: {e}")
             return [] 
 
+# --- Rate Limiting ---
+
+limiter = RateLimiter(REQUESTS_PER_MINUTE)
+
+# --- Helper Functions for Concurrent Embedding ---
+
+PendingBatch = Tuple[List[str], List[str], List[Dict], Future]
+
+def submit_batch(
+    ids: List[str],
+    documents: List[str],
+    metadatas: List[Dict],
+    embedder: GeminiEmbeddingFunction,
+    executor: ThreadPoolExecutor
+) -> PendingBatch:
+    """Starts embedding the batch on the worker pool."""
+    print(f"Submitting batch of {len(ids)} documents...")
+    return ids, documents, metadatas, executor.submit(embedder, documents)
+
+def add_batch_to_chroma(pending: PendingBatch, collection: chromadb.Collection) -> int:
+    """
+    Waits for a submitted batch's embeddings and adds it to ChromaDB from the
+    calling thread, so all writes stay on one thread.
+    """
+    ids, documents, metadatas, future = pending
+    try:
+        # Chroma validates the embedder's output and raises on the [] a failed API call returns
+        embeddings = future.result()
+    except Exception as e:
+        print(f"Skipping batch of {len(ids)} documents: embedding failed ({e}).")
+        return 0
+    if len(embeddings) != len(ids):
+        print(f"Skipping batch of {len(ids)} documents: embedding failed.")
+        return 0
+
+    # upsert: a row re-embedded after --rebuild or a partial run replaces the stored one
+    collection.upsert(
+        ids=ids,
+        embeddings=embeddings,
+        documents=documents,
+        metadatas=metadatas
+    )
+    return len(ids)
+
 # ----------------------------------------------------------------------
 # --- Initialize ChromaDB and Embedder ---
 # ----------------------------------------------------------------------
@@ -74,30 +157,29 @@ gemini_embedder = GeminiEmbeddingFunction(
     output_dim=EMBEDDING_DIMENSION
 )
 
-# Initialize ChromaDB Persistent Client
-client = chromadb.PersistentClient(CHROMA_PATH)
+# Initialize ChromaDB client (HTTP server if configured, else the local persistent store)
+if CHROMA_HOST:
+    client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+else:
+    client = chromadb.PersistentClient(CHROMA_PATH)
 
-# --- ACTION: Delete and Recreate the Collection ---
 print(f"\n--- ChromaDB Setup ---")
-try:
-    client.delete_collection(name=COLLECTION_NAME)
-    print(f" Successfully deleted old collection: '{COLLECTION_NAME}'")
-except ValueError as e:
-    if "does not exist" in str(e):
-        print(f"Collection '{COLLECTION_NAME}' did not exist, proceeding to create.")
-    else:
-        raise e
-except Exception as e:
-    print(f"Error during collection deletion: {e}")
-
-# Create the new collection with the custom embedder
-collection = client.get_or_create_collection(
-    name=COLLECTION_NAME,
-    embedding_function=gemini_embedder 
+# Create (or reopen) the collection with the custom embedder; --rebuild drops it first
+collection = open_collection(
+    client,
+    COLLECTION_NAME,
+    collection_metadata(HNSW_METADATA, MODEL_NAME, EMBEDDING_DIMENSION),
+    REBUILD,
+    embedding_function=gemini_embedder
 )
 
 print(f"Collection '{COLLECTION_NAME}' is ready (Initial Count: {collection.count()}).")
 
+# One ID-only read up front, so rerun rows never reach the embedding API
+existing_ids = set() if REBUILD else set(collection.get(include=[])["ids"])
+if existing_ids:
+    print(f"Skipping {len(existing_ids)} IDs already in the collection (pass --rebuild to re-embed).")
+
 # ----------------------------------------------------------------------
 # --- Process CSV and Add to ChromaDB ---
 # ----------------------------------------------------------------------
@@ -108,24 +190,25 @@ print(f"\n--- Starting CSV Processing ---")
 ids: List[str] = []
 documents: List[str] = []
 metadatas: List[dict] = []
+pending: Deque[PendingBatch] = deque()
+executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS)
 BATCH_SIZE = 50 
+# IDs already batched; duplicates are dropped here, before they cost an embedding call
+seen_ids: Set[str] = set()
 row_counter = 0
 
 try:
     with open(CSV_FILE_PATH, newline='', encoding="utf-8") as csvfile:
-        reader = csv.reader(csvfile)
-        header = next(reader, None) 
-        
-        if header is None:
-             print("Error: CSV file is empty.")
-             exit()
+        # C parser, all columns as plain strings; the header row is consumed here. Short rows
+        # come back padded with "", rows with extra fields are skipped with a warning
+        try:
+            frame = pd.read_csv(csvfile, dtype=str, keep_default_na=False, on_bad_lines="warn")
+        except pd.errors.EmptyDataError:
+            print("Error: CSV file is empty.")
+            exit()
 
-        for i, row in enumerate(reader):
+        for i, row in enumerate(frame.itertuples(index=False, name=None)):
             row_counter = i + 1
-            if not row or len(row) < 4: 
-                print(f"Skipping row {row_counter}: Incomplete data.")
-                continue
-            
             try:
                 osd_id = row[0]
                 title = row[1]
@@ -133,6 +216,13 @@ try:
                 description = row[3]
                 link = f"https://osdr.nasa.gov/bio/repo/data/studies/{osd_id}"
 
+                if osd_id in seen_ids:
+                    print(f"Skipping row {row_counter}: Duplicate OSD ID {osd_id}.")
+                    continue
+                seen_ids.add(osd_id)
+                if f"chunk_{osd_id}" in existing_ids:
+                    continue
+
                 layer1_text = f"Title: {title}\nDescription: {description}"
                 
                 # Append to batches
@@ -147,20 +237,15 @@ try:
 
                 # Check if batch is full
                 if len(ids) >= BATCH_SIZE:
-                    print(f"Processing batch of {len(ids)} documents...")
-                    collection.add(
-                        ids=ids,
-                        documents=documents,
-                        metadatas=metadatas
-                    )
-                    
-                    # --- ACTION: Introduce 60-second delay for API rate limit ---
-                    print("Quota delay: Sleeping for 60 seconds...")
-                    time.sleep(60) # Pause for 1 minute after adding a batch
+                    pending.append(submit_batch(ids, documents, metadatas, gemini_embedder, executor))
                     
                     # Reset batches
                     ids, documents, metadatas = [], [], []
 
+                    # Write the oldest batch once enough are in flight, bounding memory
+                    if len(pending) >= MAX_PENDING:
+                        add_batch_to_chroma(pending.popleft(), collection)
+
             except IndexError:
                 print(f"Skipping row {row_counter}: Data format error (missing column).")
             except Exception as e:
@@ -169,14 +254,9 @@ try:
 
         # Add any remaining documents
         if ids:
-            print(f"Processing final batch of {len(ids)} documents...")
-            collection.add(
-                ids=ids,
-                documents=documents,
-                metadatas=metadatas
-            )
-            # Delay after final batch
-            time.sleep(1)
+            pending.append(submit_batch(ids, documents, metadatas, gemini_embedder, executor))
+        while pending:
+            add_batch_to_chroma(pending.popleft(), collection)
 
         final_count = collection.count()
         print(f"\nProcessing complete. Total rows in CSV: {row_counter}. Final ChromaDB count: {final_count}")
@@ -184,4 +264,6 @@ try:
 except FileNotFoundError:
     print(f"Error: CSV file not found at {CSV_FILE_PATH}")
 except Exception as e:
-    print(f"An unexpected critical error occurred: {e}") 
\ No newline at end of file
+    print(f"An unexpected critical error occurred: {e}")
+finally:
+    executor.shutdown(cancel_futures=True) 
\ No newline at end of file
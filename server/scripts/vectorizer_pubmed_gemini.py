@@ -1,13 +1,20 @@
-import csv
 import os
-import time
-from typing import List, Dict, Tuple
+import sys
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Deque, List, Dict, Set, Tuple
 import chromadb
+import pandas as pd
 from google import genai
 from chromadb.api.types import Documents, Embeddings
 from chromadb.utils import embedding_functions
 from dotenv import load_dotenv
 
+from embed_cache import EmbedCache, l2_normalize
+from rate_limit import RateLimiter
+from vector_store import collection_metadata, open_collection
+
 load_dotenv()
 
 # --- Configuration ---
@@ -17,29 +24,60 @@ if not GEMINI_API_KEY:
 
 # ChromaDB Configuration
 CHROMA_PATH = "server/static/chroma"
+# Set CHROMA_HOST to write through a Chroma server (`chroma run --path server/static/chroma`)
+# instead of opening the store in-process, so several vectorizers can ingest at once
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", 8000))
 COLLECTION_NAME = "research_papers"
+# Rows already in the collection are skipped unless --rebuild drops and recreates it
+REBUILD = "--rebuild" in sys.argv
 CSV_FILE_PATH = "server/static/data_pubmed.csv"
 
 # Gemini Embedding Configuration
 MODEL_NAME = "models/gemini-embedding-001"
-EMBEDDING_DIMENSION = 2560 
+# Matryoshka-trained model: a 1024-D prefix keeps retrieval quality at 40% of the size.
+# Must match GEMINI_EMBEDDING_DIM used by the app for queries and by the Atlas index.
+EMBEDDING_DIMENSION = int(os.getenv("GEMINI_EMBEDDING_DIM", 1024))
 BATCH_SIZE = 50 
-DELAY_SECONDS = 60  # Delay after each batch to manage quota
+EMBED_WORKERS = 8  # Concurrent embed_content requests
+# Quota is enforced by spacing requests, not by sleeping after every batch
+REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_EMBED_RPM", 60))
+MAX_PENDING = EMBED_WORKERS * 2  # Embedded batches held in memory awaiting the Chroma write
+
+# HNSW index parameters (recall vs. latency); fixed when the collection is created
+HNSW_METADATA = {
+    # Embeddings are stored L2-normalized, so inner product ranks exactly like cosine
+    "hnsw:space": "ip",
+    "hnsw:M": 16,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 50,
+}
 
 # --- Custom Gemini Embedding Function for ChromaDB ---
 
+@lru_cache(maxsize=None)
+def get_genai_client(api_key: str) -> genai.Client:
+    # One client per key: every embedder instance and worker thread shares its pooled connections
+    return genai.Client(api_key=api_key)
+
 class GeminiEmbeddingFunction(embedding_functions.EmbeddingFunction):
     """Custom EmbeddingFunction using the Google Gemini API with output dimension control."""
     def __init__(self, api_key: str, model_name: str, output_dim: int):
-        self.client = genai.Client(api_key=api_key)
+        self.client = get_genai_client(api_key)
         self.model = model_name
         self.output_dim = output_dim
+        self.cache = EmbedCache()
 
     def __call__(self, input: Documents) -> Embeddings:
+        """Serves cached vectors, only sends the cache misses to Gemini, and L2-normalizes the result."""
+        return l2_normalize(self.cache.get_or_compute_many(input, f"{self.model}:{self.output_dim}", self.embed_batch))
+
+    def embed_batch(self, input: List[str]) -> Embeddings:
         """Generates embeddings for a list of documents (batching)."""
         embeddings_list: List[List[float]] = []
         
         try:
+            limiter.wait()
             result = self.client.models.embed_content(
                 model=self.model,
                 contents=input, 
@@ -64,49 +102,49 @@ class GeminiEmbeddingFunction(embedding_functions.EmbeddingFunction):
             print(f"Error calling Gemini embedding API for batch of size {len(input)}: {e}")
             return [] 
 
-# --- Helper Function to Handle De-duplication and Insertion ---
+# --- Rate Limiting ---
+
+limiter = RateLimiter(REQUESTS_PER_MINUTE)
+
+# --- Helper Functions for Concurrent Embedding and Insertion ---
+
+PendingBatch = Tuple[List[str], List[str], List[Dict], Future]
 
-def add_batch_to_chroma(
+def submit_batch(
     ids: List[str], 
     documents: List[str], 
     metadatas: List[Dict], 
-    collection: chromadb.Collection, 
-    delay: int
-) -> int:
+    embedder: GeminiEmbeddingFunction,
+    executor: ThreadPoolExecutor
+) -> PendingBatch:
+    """Starts embedding the batch on the worker pool (IDs are already unique, see seen_ids)."""
+    print(f"Submitting batch of {len(ids)} documents...")
+    return ids, documents, metadatas, executor.submit(embedder, documents)
+
+def add_batch_to_chroma(pending: PendingBatch, collection: chromadb.Collection) -> int:
     """
-    Processes the current batch: enforces ID uniqueness (by keeping the last entry), 
-    adds to ChromaDB, and applies rate limiting delay.
+    Waits for a submitted batch's embeddings and adds it to ChromaDB from the
+    calling thread, so all writes stay on one thread.
     """
-    if not ids:
+    ids, documents, metadatas, future = pending
+    try:
+        # Chroma validates the embedder's output and raises on the [] a failed API call returns
+        embeddings = future.result()
+    except Exception as e:
+        print(f"Skipping batch of {len(ids)} documents: embedding failed ({e}).")
+        return 0
+    if len(embeddings) != len(ids):
+        print(f"Skipping batch of {len(ids)} documents: embedding failed.")
         return 0
-        
-    # --- DEDUPLICATION: Use a dict to keep only the last occurrence of each ID ---
-    unique_data: Dict[str, Tuple[str, Dict]] = {}
-    for i in range(len(ids)):
-        unique_data[ids[i]] = (documents[i], metadatas[i])
-        
-    unique_ids = list(unique_data.keys())
-    unique_documents = [item[0] for item in unique_data.values()]
-    unique_metadatas = [item[1] for item in unique_data.values()]
-
-    # Reporting on deduplication
-    duplicates_found = len(ids) - len(unique_ids)
-    if duplicates_found > 0:
-        print(f"Warning: Removed {duplicates_found} local duplicates from this batch.")
-
-    if unique_ids:
-        print(f"Processing unique batch of {len(unique_ids)} documents...")
-        collection.add(
-            ids=unique_ids,
-            documents=unique_documents,
-            metadatas=unique_metadatas
-        )
-        
-        # Quota Management: Pause after a successful API call
-        print(f"Batch completed. Quota delay: Sleeping for {delay} seconds...")
-        time.sleep(delay) 
-        
-    return len(unique_ids)
+
+    # upsert: a row re-embedded after --rebuild or a partial run replaces the stored one
+    collection.upsert(
+        ids=ids,
+        embeddings=embeddings,
+        documents=documents,
+        metadatas=metadatas
+    )
+    return len(ids)
 
 # ----------------------------------------------------------------------
 # --- Main Execution ---
@@ -119,30 +157,29 @@ gemini_embedder = GeminiEmbeddingFunction(
     output_dim=EMBEDDING_DIMENSION
 )
 
-# Initialize ChromaDB Persistent Client
-client = chromadb.PersistentClient(CHROMA_PATH)
+# Initialize ChromaDB client (HTTP server if configured, else the local persistent store)
+if CHROMA_HOST:
+    client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+else:
+    client = chromadb.PersistentClient(CHROMA_PATH)
 
-# --- ACTION: Delete and Recreate the Collection to resolve conflicts ---
 print(f"\n--- ChromaDB Setup ---")
-try:
-    client.delete_collection(name=COLLECTION_NAME)
-    print(f"Successfully deleted old collection: '{COLLECTION_NAME}'")
-except ValueError as e:
-    if "does not exist" in str(e):
-        print(f"Collection '{COLLECTION_NAME}' did not exist, proceeding to create.")
-    else:
-        raise e
-except Exception as e:
-    print(f"Error during collection deletion: {e}")
-
-# Create the new collection with the custom embedder
-collection = client.get_or_create_collection(
-    name=COLLECTION_NAME,
-    embedding_function=gemini_embedder 
+# Create (or reopen) the collection with the custom embedder; --rebuild drops it first
+collection = open_collection(
+    client,
+    COLLECTION_NAME,
+    collection_metadata(HNSW_METADATA, MODEL_NAME, EMBEDDING_DIMENSION),
+    REBUILD,
+    embedding_function=gemini_embedder
 )
 
 print(f"Collection '{COLLECTION_NAME}' is ready (Initial Count: {collection.count()}).")
 
+# One ID-only read up front, so rerun rows never reach the embedding API
+existing_ids = set() if REBUILD else set(collection.get(include=[])["ids"])
+if existing_ids:
+    print(f"Skipping {len(existing_ids)} IDs already in the collection (pass --rebuild to re-embed).")
+
 # ----------------------------------------------------------------------
 # --- Process CSV Data ---
 # ----------------------------------------------------------------------
@@ -153,25 +190,25 @@ print(f"\n--- Starting CSV Processing ---")
 ids: List[str] = []
 documents: List[str] = []
 metadatas: List[dict] = []
+pending: Deque[PendingBatch] = deque()
+executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS)
+# IDs already batched; duplicates are dropped here, before they cost an embedding call
+seen_ids: Set[str] = set()
 row_counter = 0
 total_added = 0
 
 try:
     with open(CSV_FILE_PATH, newline='', encoding="utf-8") as csvfile:
-        reader = csv.reader(csvfile)
-        header = next(reader, None)
-        
-        if header is None:
-             print("Error: CSV file is empty.")
-             exit()
+        # C parser, all columns as plain strings; the header row is consumed here. Short rows
+        # come back padded with "", rows with extra fields are skipped with a warning
+        try:
+            frame = pd.read_csv(csvfile, dtype=str, keep_default_na=False, on_bad_lines="warn")
+        except pd.errors.EmptyDataError:
+            print("Error: CSV file is empty.")
+            exit()
 
-        for i, row in enumerate(reader):
+        for i, row in enumerate(frame.itertuples(index=False, name=None)):
             row_counter = i + 1
-            # Check for sufficient columns
-            if not row or len(row) < 15: 
-                print(f"Skipping row {row_counter}: Incomplete data.")
-                continue
-            
             try:
                 # Data extraction based on your CSV structure (0-indexed)
                 pmc_id = row[0].strip()
@@ -187,6 +224,12 @@ try:
                 if not pmc_id:
                     print(f"Skipping row {row_counter}: Empty PMC_ID.")
                     continue
+                if pmc_id in seen_ids:
+                    print(f"Skipping row {row_counter}: Duplicate PMC_ID {pmc_id}.")
+                    continue
+                seen_ids.add(pmc_id)
+                if f"chunk_{pmc_id}" in existing_ids:
+                    continue
 
                 # Data to embed
                 layer1_text = f"Title: {title}\nAbstract: {abstract}"
@@ -206,12 +249,15 @@ try:
 
                 # Check if batch is full
                 if len(ids) >= BATCH_SIZE:
-                    added_count = add_batch_to_chroma(ids, documents, metadatas, collection, DELAY_SECONDS)
-                    total_added += added_count
+                    pending.append(submit_batch(ids, documents, metadatas, gemini_embedder, executor))
                     
                     # Reset batches
                     ids, documents, metadatas = [], [], []
 
+                    # Write the oldest batch once enough are in flight, bounding memory
+                    if len(pending) >= MAX_PENDING:
+                        total_added += add_batch_to_chroma(pending.popleft(), collection)
+
             except IndexError:
                 print(f"Skipping row {row_counter}: Data format error (missing column).")
             except Exception as e:
@@ -220,8 +266,9 @@ try:
 
         # Add any remaining documents
         if ids:
-            added_count = add_batch_to_chroma(ids, documents, metadatas, collection, 1) # Short delay for final small batch
-            total_added += added_count
+            pending.append(submit_batch(ids, documents, metadatas, gemini_embedder, executor))
+        while pending:
+            total_added += add_batch_to_chroma(pending.popleft(), collection)
 
         final_count = collection.count()
         print(f"\nProcessing complete.")
@@ -232,3 +279,5 @@ except FileNotFoundError:
     print(f"Error: CSV file not found at {CSV_FILE_PATH}")
 except Exception as e:
     print(f"An unexpected critical error occurred: {e}")
+finally:
+    executor.shutdown(cancel_futures=True)
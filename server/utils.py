@@ -1,50 +1,144 @@
-import math
 import os
-from typing import List, cast
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Tuple, cast
 
 import google.generativeai as genai
+import numpy as np
 
 import dotenv
 dotenv.load_dotenv()
 
+# Read once at import; the SDK is configured a single time rather than per call
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+EMBEDDING_DIM = int(os.getenv("GEMINI_EMBEDDING_DIM", 1024))
+# Seconds before a Gemini embedding call is abandoned, so a hung call fails its batch only
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", 10))
+
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY)  # type: ignore[attr-defined]
+
 # Embedding function using Google Gemini via google-generativeai SDK
 def generate_embeddings(query: str) -> List[float]:
     """Embed a single query string (RAG-friendly, simple path).
 
     - Uses google.generativeai with model "models/gemini-embedding-001".
-    - Returns a list[float] embedding; returns [] on failure or empty input.
+    - Returns a unit-length list[float] embedding; returns [] on failure or empty input.
+    - Repeated queries are served from an in-process LRU cache.
     """
     # Fast no-op for blank inputs
     if not query or not query.strip():
         return []
 
-    api_key = os.getenv("GEMINI_API_KEY")
-    model_dim = int(os.getenv("GEMINI_EMBEDDING_DIM", 2560))
-    if not api_key:
+    if not GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY not set in environment")
 
-    model_name = "models/gemini-embedding-001"
-    genai.configure(api_key=api_key)  # type: ignore[attr-defined]
-
     try:
-        resp = genai.embed_content(model=model_name, content=query.strip(), output_dimensionality=model_dim)  # type: ignore[attr-defined]
-        # Expected shape: { "embedding": { "values": [...] } }
-        emb = resp.get("embedding") or {}
-        vec = emb.get("values") if isinstance(emb, dict) else emb
-        if not isinstance(vec, list):
-            return []
-        return cast(List[float], vec)
+        return list(_embed(query.strip()))
     except Exception as e:
         print(f" Error generating embedding for query (len={len(query)}): {e}")
         return []
 
+@lru_cache(maxsize=4096)
+def _embed(query: str) -> Tuple[float, ...]:
+    # Raises on failure so that errors are never cached
+    vec = np.asarray(_batcher.embed(query), dtype=np.float32)
+    # L2-normalize once so similarity against stored (unit) vectors is a plain dot product
+    vec /= np.linalg.norm(vec) + 1e-12
+    return tuple(vec.tolist())
+
+def _embed_batch(texts: List[str]) -> List[List[float]]:
+    """One Gemini call for a list of texts; raises on failure."""
+    resp = genai.embed_content(model=EMBEDDING_MODEL, content=texts, output_dimensionality=EMBEDDING_DIM, request_options={"timeout": EMBED_TIMEOUT})  # type: ignore[attr-defined]
+    # Expected shape for list content: { "embedding": [[...], [...]] }
+    vecs = resp.get("embedding")
+    if not isinstance(vecs, list) or len(vecs) != len(texts):
+        raise RuntimeError("Unexpected embedding response shape")
+    return cast(List[List[float]], vecs)
+
+class _EmbeddingBatcher:
+    """
+    Coalesces concurrent embedding requests into a single batched Gemini call.
+
+    Request threads block on a Future while a background thread drains the
+    queue every `window` seconds (or as soon as `max_batch` texts are waiting)
+    and hands each batch to a small pool, so up to `max_calls` Gemini calls are
+    in flight and one slow call doesn't hold up the batches behind it.
+    """
+
+    def __init__(self, window: float = 0.005, max_batch: int = 16, max_calls: int = 4):
+        self._window = window
+        self._max_batch = max_batch
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=max_calls, thread_name_prefix="embedding-call")
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def embed(self, text: str) -> List[float]:
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._window
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._pool.submit(self._resolve, batch)
+
+    @staticmethod
+    def _resolve(batch: List[Tuple[str, Future]]) -> None:
+        try:
+            vectors = _embed_batch([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), vec in zip(batch, vectors):
+            future.set_result(vec)
+
+_batcher = _EmbeddingBatcher()
+
 # helper: cosine similarity
-def cosine_similarity(a, b):
+def cosine_similarity(a, b, normalized: bool = False):
+    """Cosine of `a` and `b`; pass normalized=True for unit vectors (a single dot product)."""
     if a is None or b is None:
         return -1.0
-    dot = sum(x * y for x, y in zip(a, b))
-    norm_a = math.sqrt(sum(x * x for x in a))
-    norm_b = math.sqrt(sum(y * y for y in b))
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    if normalized:
+        return float(a @ b)
+    norm_a = np.linalg.norm(a)
+    norm_b = np.linalg.norm(b)
     if norm_a == 0 or norm_b == 0:
         return -1.0
-    return dot / (norm_a * norm_b)
+    return float(a @ b) / float(norm_a * norm_b)
+
+def cosine_similarity_batch(q, M, normalized: bool = False) -> np.ndarray:
+    """Cosine of query `q` against every row of `M` in one matrix-vector product.
+
+    Rows (or a query) with zero norm score -1.0, matching `cosine_similarity`.
+    With normalized=True the rows and query are taken to be unit vectors.
+    """
+    q = np.asarray(q, dtype=np.float32)
+    M = np.asarray(M, dtype=np.float32)
+    if M.size == 0:
+        return np.empty(0, dtype=np.float32)
+    if normalized:
+        return M @ q
+    norms = np.linalg.norm(M, axis=1) * np.linalg.norm(q)
+    scores = np.full(M.shape[0], -1.0, dtype=np.float32)
+    np.divide(M @ q, norms, out=scores, where=norms != 0)
+    return scores